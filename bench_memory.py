@@ -0,0 +1,101 @@
+"""Порівняння пам'яті: словники замовлень попередньої версії проти записів OrderRecord/UserRecord.
+
+Запуск: python bench_memory.py [кількість_замовлень]
+"""
+import gc
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+from database import OrderRecord, UserRecord
+
+ORDERS_PER_USER = 4
+
+
+def sample_drafts(count: int):
+    """Чернетки замовлень у тому вигляді, в якому їх збирає bot.py"""
+    rnd = random.Random(42)
+    start = datetime(2025, 1, 1)
+    for n in range(count):
+        user_id = 100000 + n // ORDERS_PER_USER
+        # Рядки створюються заново, як після json.load або з апдейтів Telegram
+        draft = {
+            'order_type': ''.join(rnd.choice(['in_stock', 'pre_order'])),
+            'order_details': f"Кросівки розмір {rnd.randint(36, 46)}, колір {rnd.choice(['білий', 'чорний'])}",
+            'payment_method': ''.join(rnd.choice(['cash_on_delivery', 'prepayment'])),
+            'address': f"м. Київ, відділення Нової Пошти №{rnd.randint(1, 400)}",
+            'username': f"user{user_id}",
+            'first_name': ''.join(['Ім', "'я"]),
+        }
+        yield n, user_id, draft, (start + timedelta(minutes=n)).isoformat()
+
+
+def build_legacy(count: int):
+    """Структури попередньої версії: вкладені словники з копіями даних користувача"""
+    users, orders = {}, {}
+    for n, user_id, draft, created in sample_drafts(count):
+        order_id = f"ORDER_{n + 1:06d}"
+        user = users.setdefault(str(user_id), {
+            'username': draft['username'],
+            'first_name': draft['first_name'],
+            'joined_date': created,
+            'orders': []
+        })
+        orders[order_id] = {
+            'id': order_id,
+            'user_id': user_id,
+            'username': draft['username'],
+            'first_name': draft['first_name'],
+            'order_data': draft,
+            'status': ''.join(['Нов', 'ий']),
+            'created_date': created
+        }
+        user['orders'].append(f"ORDER_{n + 1:06d}")
+    return users, orders
+
+
+def build_records(count: int):
+    """Компактні записи поточної версії"""
+    users, orders = {}, {}
+    for n, user_id, draft, created in sample_drafts(count):
+        order_id = f"ORDER_{n + 1:06d}"
+        user = users.get(str(user_id))
+        if user is None:
+            user = users[str(user_id)] = UserRecord(draft['username'], draft['first_name'], created)
+        order = OrderRecord(
+            order_id, user_id, draft['username'], draft['first_name'],
+            status=''.join(['Нов', 'ий']), created_date=created,
+            **{field: draft.get(field) for field in OrderRecord.ORDER_FIELDS}
+        )
+        orders[order.id] = order
+        user.orders.append(order.id)
+    return users, orders
+
+
+def measure(builder, count: int) -> int:
+    """Пам'ять, яку займають побудовані структури"""
+    gc.collect()
+    tracemalloc.start()
+    data = builder(count)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    legacy = measure(build_legacy, count)
+    records = measure(build_records, count)
+
+    print(f"Замовлень: {count}")
+    print(f"Словники (попередня версія): {legacy / 2**20:8.1f} МБ  ({legacy / count:6.0f} Б/замовлення)")
+    print(f"OrderRecord/UserRecord:      {records / 2**20:8.1f} МБ  ({records / count:6.0f} Б/замовлення)")
+    print(f"Економія: {(1 - records / legacy) * 100:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,37 @@
 import logging
 import asyncio
+import os
 import signal
 import sys
-from datetime import datetime
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 from logging.handlers import RotatingFileHandler
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, ConversationHandler
+from telegram import Update, InputFile
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters, ContextTypes,
+    ConversationHandler, PicklePersistence, PersistenceInput
+)
 from telegram.constants import ParseMode
+from telegram.request import BaseRequest
+from telegram.error import BadRequest
 
-from config import BOT_TOKEN, ADMIN_IDS, WELCOME_MESSAGE, SHOP_NAME
+from config import (
+    BOT_TOKEN, ADMIN_IDS, WELCOME_MESSAGE, SHOP_NAME, OUTBOUND_RATE, OUTBOUND_MAX_RETRIES,
+    OFF_PEAK_START_HOUR, OFF_PEAK_END_HOUR, BROADCAST_MAX_UPDATE_RATE, BROADCAST_PAUSE_SECONDS,
+    BROADCAST_CHECKPOINT_EVERY, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, SLOW_UPDATE_THRESHOLD_MS,
+    DRAIN_TIMEOUT, MY_ORDERS_PAGE_SIZE, MY_ORDERS_CACHE_SIZE
+)
 from database import Database
+from idempotency import IdempotentCalls
 from keyboards import *
+from outbound import OutboundScheduler, Priority
+from profiling import is_profiling, run_profile, stop_profile
+from router import CallbackRouter
+from tracing import finish_trace, span, start_trace, traced_handler
+from view_cache import ViewCache
 
 # Налаштування логування для продакшену
 logging.basicConfig(
@@ -23,14 +44,45 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Окремий журнал повільних оновлень: один JSON-рядок на оновлення
+slow_logger = logging.getLogger('slow_updates')
+slow_logger.propagate = False
+_slow_handler = RotatingFileHandler('slow_updates.log', encoding='utf-8', maxBytes=10*1024*1024, backupCount=3)
+_slow_handler.setFormatter(logging.Formatter('%(message)s'))
+slow_logger.addHandler(_slow_handler)
+
 # Стани розмови
 CHOOSING_OPTION, ENTERING_ORDER, CHOOSING_PAYMENT, ENTERING_ADDRESS, CONFIRMING_ORDER = range(5)
 
 # Ініціалізація бази даних
 db = Database()
 
-# Словник для зберігання тимчасових даних користувачів
-user_data = {}
+# Єдина черга вихідних повідомлень
+outbox = OutboundScheduler(rate=OUTBOUND_RATE, max_retries=OUTBOUND_MAX_RETRIES)
+
+# Таблиця маршрутів для натискань inline-кнопок
+callback_router = CallbackRouter(ADMIN_IDS)
+
+# Кеш відрендерених адмінських екранів
+view_cache = ViewCache()
+# Окремий кеш історії замовлень клієнтів, щоб сторінки не витісняли одна одну та адмінські екрани
+my_orders_cache = ViewCache(MY_ORDERS_CACHE_SIZE)
+
+# Підтвердження замовлень: одне замовлення на чернетку навіть при подвійних натисканнях
+order_confirmations = IdempotentCalls()
+
+# Словник для зберігання тимчасових даних користувачів (відновлюється після перезапуску)
+user_data = db.load_sessions()
+
+# Стан граціозного завершення
+shutdown_state = {
+    'started': None,
+    'forced': None
+}
+
+# Час надходження останніх оновлень для оцінки навантаження
+update_times = deque()
+UPDATE_RATE_WINDOW = 60
 
 # Статистика бота
 bot_stats = {
@@ -40,18 +92,386 @@ bot_stats = {
     'errors': 0
 }
 
-async def graceful_shutdown(signal, loop):
-    """Граціозне завершення роботи бота"""
-    logger.info(f"Отримано сигнал {signal.name}...")
-    logger.info("Зупиняю бота...")
+class BotApplication(Application):
+    """Застосунок з трасуванням обробки кожного оновлення"""
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Кількість оновлень, що зараз обробляються
+        self.in_flight = 0
     
-    # Зберігаємо статистику
+    async def process_update(self, update: object) -> None:
+        trace, token = start_trace()
+        self.in_flight += 1
+        try:
+            with span('dispatch'):
+                await super().process_update(update)
+        finally:
+            self.in_flight -= 1
+            finish_trace(token)
+            if trace.elapsed_ms() >= SLOW_UPDATE_THRESHOLD_MS:
+                log_slow_update(trace, update)
+
+def log_slow_update(trace, update: object):
+    """Запис повільного оновлення у журнал"""
+    try:
+        fields = {'time': datetime.now().isoformat()}
+        if isinstance(update, Update):
+            fields['update_id'] = update.update_id
+            fields['user_id'] = update.effective_user.id if update.effective_user else None
+            if update.callback_query:
+                fields['kind'] = f"callback:{update.callback_query.data}"
+            elif update.message and update.message.text:
+                fields['kind'] = update.message.text.split()[0] if update.message.text.startswith('/') else 'text'
+            else:
+                fields['kind'] = 'other'
+            # Затримка між відправкою користувачем і початком обробки
+            message = update.message or update.edited_message
+            if message and message.date:
+                backlog = datetime.now(timezone.utc) - message.date - timedelta(milliseconds=trace.elapsed_ms())
+                fields['backlog_ms'] = round(backlog.total_seconds() * 1000, 2)
+        slow_logger.info(trace.to_log_line(**fields))
+    except Exception as e:
+        logger.error(f"Помилка запису повільного оновлення: {e}")
+
+def is_shutting_down() -> bool:
+    """Чи триває граціозне завершення"""
+    return shutdown_state['started'] is not None
+
+def graceful_shutdown(sig, application: Application):
+    """Граціозне завершення: зупинка прийому оновлень і дренаж"""
+    if is_shutting_down():
+        # Повторний сигнал - не чекаємо завершення дренажу
+        request_force_shutdown(application, f"повторно отримано сигнал {sig.name}")
+        return
+    
+    shutdown_state['started'] = time.monotonic()
+    logger.info(f"Отримано сигнал {sig.name}...")
+    logger.info(f"Зупиняю бота... (оновлень в обробці: {application.in_flight})")
+    
+    # Профілювання завершується достроково, щоб не затримувати дренаж; звіт надсилається за зібраний час
+    stop_profile()
+    
+    # Якщо дренаж не вкладеться у відведений час, зберігаємо дані і виходимо примусово
+    asyncio.get_running_loop().call_later(
+        DRAIN_TIMEOUT, request_force_shutdown, application, f"дренаж не завершився за {DRAIN_TIMEOUT} с"
+    )
+    
+    # Зупиняє отримання оновлень; далі PTB доопрацьовує чергу і викликає post_stop
+    application.stop_running()
+
+def flush_state():
+    """Збереження бази, чернеток і статистики на диск"""
+    try:
+        db.flush()
+        db.save_sessions(user_data)
+    except Exception as e:
+        logger.error(f"Помилка збереження даних: {e}")
     save_bot_stats()
+
+def request_force_shutdown(application: Application, reason: str):
+    """Запуск примусового завершення (один раз)"""
+    if shutdown_state['forced'] is None:
+        shutdown_state['forced'] = asyncio.get_running_loop().create_task(force_shutdown(application, reason))
+
+async def force_shutdown(application: Application, reason: str):
+    """Примусове завершення після збереження даних"""
+    logger.error(f"Примусовий вихід: {reason}")
+    flush_state()
+    
+    # Стан розмов зберігається разом із чернетками, щоб файли не розходилися
+    try:
+        await asyncio.wait_for(flush_persistence(application), timeout=5)
+    except Exception as e:
+        logger.error(f"Помилка збереження стану розмов: {e}")
     
-    # Зупиняємо event loop
-    loop.stop()
+    logging.shutdown()
+    os._exit(1)
+
+async def flush_persistence(application: Application):
+    """Запис стану розмов і context.user_data на диск"""
+    if application.persistence is not None:
+        await application.update_persistence()
+        await application.persistence.flush()
+
+# Сегменти аудиторії для розсилок: ключ -> (назва, функція вибору ID)
+BROADCAST_SEGMENTS = {
+    'ordered': ("🛒 Робили замовлення", lambda: db.get_segment('ordered')),
+    'never_ordered': ("🙈 Ще не замовляли", lambda: db.get_segment('never_ordered')),
+    'in_stock': ("🏀 Замовляли з наявності", lambda: db.get_segment('order_type:in_stock')),
+    'pre_order': ("📋 Замовляли під замовлення", lambda: db.get_segment('order_type:pre_order')),
+    'cash_on_delivery': ("💵 Накладний платіж", lambda: db.get_segment('payment_method:cash_on_delivery')),
+    'prepayment': ("💳 Передплата", lambda: db.get_segment('payment_method:prepayment')),
+    'joined_month': ("🆕 Приєдналися цього місяця", lambda: db.users_joined_between(
+        datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0))),
+    'ordered_30d': ("📅 Замовляли за 30 днів", lambda: db.users_last_ordered_between(
+        datetime.now() - timedelta(days=30))),
+}
+
+def resolve_broadcast_audience(selection: dict) -> set:
+    """ID отримувачів розсилки за обраними сегментами (без вибору - всі користувачі)"""
+    include = [BROADCAST_SEGMENTS[key][1]() for key, mode in selection.items() if mode == 'include']
+    require = [BROADCAST_SEGMENTS[key][1]() for key, mode in selection.items() if mode == 'require']
+    exclude = [BROADCAST_SEGMENTS[key][1]() for key, mode in selection.items() if mode == 'exclude']
+    return db.select_audience(include=include, require=require, exclude=exclude)
+
+def describe_broadcast_audience(selection: dict) -> str:
+    """Текстовий опис обраної аудиторії"""
+    parts = [f"+ {BROADCAST_SEGMENTS[key][0]}" for key, mode in selection.items() if mode == 'include']
+    parts += [f"& {BROADCAST_SEGMENTS[key][0]}" for key, mode in selection.items() if mode == 'require']
+    parts += [f"- {BROADCAST_SEGMENTS[key][0]}" for key, mode in selection.items() if mode == 'exclude']
+    return "\n".join(parts) if parts else "Всі користувачі"
+
+def broadcast_confirmation_text(context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Текст підтвердження розсилки з аудиторією"""
+    text = context.user_data.get('broadcast_text', '')
+    selection = context.user_data.get('broadcast_segments', {})
+    audience = resolve_broadcast_audience(selection)
+    return (
+        f"📢 Текст для розсилки:\n\n{text}\n\n"
+        f"🎯 Аудиторія ({len(audience)}):\n{describe_broadcast_audience(selection)}\n\n"
+        "✅ Все правильно? Відправляємо?"
+    )
+
+def get_broadcast_segment_options(context: ContextTypes.DEFAULT_TYPE) -> list:
+    """Список сегментів з поточним режимом для клавіатури"""
+    selection = context.user_data.get('broadcast_segments', {})
+    return [(key, label, selection.get(key)) for key, (label, _) in BROADCAST_SEGMENTS.items()]
+
+async def track_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Облік вхідних оновлень для оцінки навантаження"""
+    now = time.monotonic()
+    update_times.append(now)
+    # Відкидаємо оновлення поза вікном, інакше без розсилок черга росте без меж
+    border = now - UPDATE_RATE_WINDOW
+    while update_times[0] < border:
+        update_times.popleft()
+
+def current_update_rate() -> float:
+    """Кількість оновлень на секунду за останнє вікно"""
+    border = time.monotonic() - UPDATE_RATE_WINDOW
+    while update_times and update_times[0] < border:
+        update_times.popleft()
+    return len(update_times) / UPDATE_RATE_WINDOW
+
+def is_off_peak(moment: datetime) -> bool:
+    """Чи припадає момент на непіковий час"""
+    if OFF_PEAK_START_HOUR <= OFF_PEAK_END_HOUR:
+        return OFF_PEAK_START_HOUR <= moment.hour < OFF_PEAK_END_HOUR
+    return moment.hour >= OFF_PEAK_START_HOUR or moment.hour < OFF_PEAK_END_HOUR
+
+def next_off_peak_start(moment: datetime) -> datetime:
+    """Найближчий момент початку непікового часу (або зараз, якщо він уже триває)"""
+    if is_off_peak(moment):
+        return moment
+    start = moment.replace(hour=OFF_PEAK_START_HOUR, minute=0, second=0, microsecond=0)
+    if start <= moment:
+        start += timedelta(days=1)
+    return start
+
+def parse_broadcast_time(text: str):
+    """Розбір часу розсилки: ГГ:ХХ (найближчий) або ДД.ММ.РРРР ГГ:ХХ"""
+    text = text.strip()
+    try:
+        return datetime.strptime(text, '%d.%m.%Y %H:%M')
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.strptime(text, '%H:%M')
+    except ValueError:
+        return None
+    now = datetime.now()
+    run_at = now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return run_at
+
+def clear_broadcast_draft(context: ContextTypes.DEFAULT_TYPE):
+    """Очищення чернетки розсилки адміна"""
+    for key in ('broadcast_text', 'broadcast_photo', 'broadcast_segments', 'admin_state'):
+        context.user_data.pop(key, None)
+
+def create_broadcast(context: ContextTypes.DEFAULT_TYPE, admin_id: int, run_at: datetime, off_peak: bool = False) -> str:
+    """Збереження чернетки розсилки як запланованої"""
+    return db.add_broadcast({
+        'text': context.user_data.get('broadcast_text', ''),
+        'photo': context.user_data.get('broadcast_photo'),
+        'segments': dict(context.user_data.get('broadcast_segments', {})),
+        'created_by': admin_id,
+        'run_at': run_at.isoformat(),
+        'off_peak': off_peak
+    })
+
+def schedule_broadcast_job(application: Application, broadcast_id: str, delay: float):
+    """Постановка розсилки в чергу завдань"""
+    application.job_queue.run_once(
+        broadcast_job,
+        when=max(0.0, delay),
+        data=broadcast_id,
+        name=f"broadcast:{broadcast_id}"
+    )
+
+async def broadcast_job(context: ContextTypes.DEFAULT_TYPE):
+    """Завдання запланованої розсилки"""
+    broadcast_id = context.job.data
+    try:
+        resume_in = await execute_broadcast(context, broadcast_id)
+        if resume_in is not None:
+            # Під час зупинки розсилку буде відновлено при наступному запуску
+            if not is_shutting_down():
+                schedule_broadcast_job(context.application, broadcast_id, resume_in)
+            return
+        
+        broadcast = db.remove_broadcast(broadcast_id)
+        if broadcast is None:
+            return
+        
+        await outbox.send(
+            Priority.ADMIN, context.bot.send_message,
+            chat_id=broadcast['created_by'],
+            text=f"✅ Розсилку {broadcast_id} завершено!\n\n"
+                 f"✅ Успішно відправлено: {broadcast['success_count']}\n"
+                 f"❌ Помилки: {broadcast['error_count']}\n\n"
+                 f"🎯 Аудиторія:\n{describe_broadcast_audience(broadcast.get('segments', {}))}"
+        )
+    except Exception as e:
+        logger.error(f"Помилка в broadcast_job: {e}")
+        bot_stats['errors'] += 1
+
+def restore_scheduled_broadcasts(application: Application):
+    """Відновлення запланованих та перерваних розсилок після перезапуску"""
+    now = datetime.now()
+    for broadcast_id, broadcast in db.broadcasts.items():
+        delay = (datetime.fromisoformat(broadcast['run_at']) - now).total_seconds()
+        schedule_broadcast_job(application, broadcast_id, delay)
+    if db.broadcasts:
+        logger.info(f"Відновлено розсилок: {len(db.broadcasts)}")
+
+async def post_init(application: Application):
+    """Запуск фонових сервісів після ініціалізації застосунку"""
+    # Налаштування сигналів для граціозного завершення
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, graceful_shutdown, sig, application)
+    
+    # Стан розмов уже завантажено в пам'ять, файл більше не потрібен (див. on_flush у build_application)
+    persistence = application.persistence
+    if persistence is not None and persistence.filepath.exists():
+        persistence.filepath.unlink()
+    
+    outbox.start()
+    restore_scheduled_broadcasts(application)
+    if user_data:
+        logger.info(f"Відновлено чернеток замовлень: {len(user_data)}")
+
+async def post_stop(application: Application):
+    """Дренаж після зупинки обробки оновлень: відправка черги і збереження даних"""
+    started = shutdown_state['started'] or time.monotonic()
+    remaining = max(1.0, DRAIN_TIMEOUT - (time.monotonic() - started))
+    if not await outbox.stop(timeout=remaining):
+        logger.warning("Не всі повідомлення з черги встигли відправитися")
+    
+    flush_state()
+    logger.info(f"Дренаж завершено за {time.monotonic() - started:.2f} с")
+
+async def post_shutdown(application: Application):
+    """Завершення роботи"""
     logger.info("Бот зупинено.")
 
+def format_outbound_metrics() -> str:
+    """Метрики черги вихідних повідомлень для адмінів"""
+    lines = ["📤 Черга відправки:"]
+    for name, m in outbox.metrics().items():
+        lines.append(
+            f"• {name}: в черзі {m['queued']}, відправлено {m['sent']}, "
+            f"помилок {m['failed']}, сер. {m['avg_latency_ms']:.0f} мс"
+        )
+    return "\n".join(lines)
+
+def render_recent_orders(limit: int = 10) -> str:
+    """Текст екрана останніх замовлень (порожній рядок, якщо замовлень немає)"""
+    orders = db.get_recent_orders(limit)
+    if not orders:
+        return ""
+    
+    orders_text = f"📋 Останні {limit} замовлень:\n\n"
+    for order in orders:
+        orders_text += f"""
+🆔 {order['id']} ({order['status']})
+👤 {order['first_name']} (@{order['username']})
+📅 {order['created_date'][:10]}
+📦 {'В наявності' if order['order_data']['order_type'] == 'in_stock' else 'Під замовлення'}
+💳 {'Накладний платіж' if order['order_data']['payment_method'] == 'cash_on_delivery' else 'Передплата'}
+📍 {order['order_data'].get('address', 'Не вказано')}
+📝 {order['order_data'].get('order_details', 'Не вказано')}
+🔗 ID користувача: {order['user_id']}
+        """
+        orders_text += "\n" + "─" * 50 + "\n"
+    
+    orders_text += "\n💬 Для відправки повідомлення замовнику використовуйте:\n"
+    orders_text += "/message НОМЕР_ЗАМОВЛЕННЯ ТЕКСТ_ПОВІДОМЛЕННЯ"
+    orders_text += "\n\n📌 Для зміни статусу замовлення:\n"
+    orders_text += "/status НОМЕР_ЗАМОВЛЕННЯ НОВИЙ_СТАТУС"
+    return orders_text
+
+def get_stats_view() -> str:
+    """Текст основної статистики бота (з кешу, поки показники не змінилися)"""
+    uptime_hours = round((datetime.now() - bot_stats['start_time']).total_seconds() / 3600, 1)
+    version = (uptime_hours, bot_stats['total_users'], bot_stats['total_orders'], bot_stats['errors'])
+    return view_cache.get_or_render(('stats',), version, lambda: f"""
+📊 Статистика бота:
+
+⏰ Час роботи: {uptime_hours:.1f} годин
+👥 Всього користувачів: {bot_stats['total_users']}
+📦 Всього замовлень: {bot_stats['total_orders']}
+❌ Помилок: {bot_stats['errors']}
+🔄 Статус: Активний
+    """)
+
+def render_my_orders(user_id: int, page: int):
+    """Текст і клавіатура сторінки історії замовлень клієнта"""
+    orders, total = db.get_user_orders_page(user_id, page, MY_ORDERS_PAGE_SIZE)
+    if not orders:
+        return "📭 У вас поки що немає замовлень", None
+    
+    pages = (total + MY_ORDERS_PAGE_SIZE - 1) // MY_ORDERS_PAGE_SIZE
+    orders_text = f"🧾 Ваші замовлення (сторінка {page + 1} з {pages}):\n"
+    for order in orders:
+        orders_text += f"""
+🆔 {order['id']}
+📅 {order['created_date'][:10]}
+📌 Статус: {order['status']}
+📦 {'В наявності' if order['order_type'] == 'in_stock' else 'Під замовлення'}
+📝 {order['order_details'] or 'Не вказано'}
+"""
+    return orders_text, get_my_orders_keyboard(page, (page + 1) * MY_ORDERS_PAGE_SIZE < total)
+
+def get_my_orders_view(user_id: int, page: int):
+    """Сторінка історії замовлень (з кешу до наступної зміни замовлень користувача)"""
+    # Кнопка зі старого повідомлення чи підроблений callback можуть вести за останню сторінку
+    pages = max(1, (db.count_user_orders(user_id) + MY_ORDERS_PAGE_SIZE - 1) // MY_ORDERS_PAGE_SIZE)
+    page = min(page, pages - 1)
+    version = db.user_versions.get(str(user_id), 0)
+    return my_orders_cache.get_or_render(('my_orders', user_id, page), version, lambda: render_my_orders(user_id, page))
+
+async def edit_view(query, text: str, reply_markup=None):
+    """Редагування повідомлення з екраном; пропускається, якщо вміст не змінився"""
+    if view_cache.is_unchanged(query.message, text, reply_markup):
+        return
+    try:
+        await outbox.send(Priority.INTERACTIVE, query.edit_message_text, text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Вміст міг змінитися між отриманням callback і редагуванням
+        if 'not modified' not in str(e):
+            raise
+
+def format_route_metrics() -> str:
+    """Кількість натискань по маршрутах кнопок"""
+    lines = ["🧭 Натискання кнопок:"]
+    for name, count in callback_router.counts.most_common(10):
+        lines.append(f"• {name}: {count}")
+    return "\n".join(lines)
+
 def save_bot_stats():
     """Збереження статистики бота"""
     try:
@@ -85,7 +505,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"Користувач {user.id} (@{user.username}) запустив бота")
         
-        await update.message.reply_text(
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
             WELCOME_MESSAGE,
             reply_markup=get_main_keyboard()
         )
@@ -93,275 +514,360 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Помилка в команді start: {e}")
         bot_stats['errors'] += 1
-        await update.message.reply_text("❌ Помилка запуску бота. Спробуйте ще раз.")
+        await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ Помилка запуску бота. Спробуйте ще раз.")
         return CHOOSING_OPTION
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обробник натискань кнопок"""
-    try:
-        query = update.callback_query
-        await query.answer()
-        
-        user_id = query.from_user.id
-        
-        if query.data == 'back_to_main':
-            # Очищаємо дані користувача при поверненні на головну
-            if user_id in user_data:
-                del user_data[user_id]
-            
-            await query.edit_message_text(
-                WELCOME_MESSAGE,
-                reply_markup=get_main_keyboard()
-            )
-            return CHOOSING_OPTION
+async def deny_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Відмова у доступі до адмін панелі"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "❌ У вас немає доступу до адмін панелі!",
+        reply_markup=get_back_keyboard()
+    )
+
+@callback_router.route('back_to_main')
+async def back_to_main_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Повернення на головну"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    
+    # Очищаємо дані користувача при поверненні на головну
+    if user_id in user_data:
+        del user_data[user_id]
+    
+    await outbox.send(
+        Priority.INTERACTIVE, query.edit_message_text,
+        WELCOME_MESSAGE,
+        reply_markup=get_main_keyboard()
+    )
+    return CHOOSING_OPTION
+
+@callback_router.route('in_stock', 'pre_order')
+async def order_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вибір типу замовлення"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    
+    # Ініціалізуємо нове замовлення з ключем для ідемпотентного підтвердження
+    user_data[user_id] = {'order_type': query.data, 'draft_id': uuid.uuid4().hex}
+    
+    message_text = "📝 Введіть деталі вашого замовлення:\n\n"
+    if query.data == 'in_stock':
+        message_text += "🏀 Що саме вас цікавить з наявності?\n"
+    else:
+        message_text += "📋 Що саме ви хочете замовити?\n"
+    
+    message_text += "\n💡 Можете прикріпити фото товару для кращого розуміння!"
+    
+    await outbox.send(
+        Priority.INTERACTIVE, query.edit_message_text,
+        message_text,
+        reply_markup=get_back_keyboard()
+    )
+    return ENTERING_ORDER
+
+@callback_router.route('cash_on_delivery', 'prepayment')
+async def payment_method_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вибір способу оплати"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    
+    if user_id in user_data and 'order_type' in user_data[user_id]:
+        user_data[user_id]['payment_method'] = query.data
         
-        elif query.data in ['in_stock', 'pre_order']:
-            # Ініціалізуємо нове замовлення
-            user_data[user_id] = {'order_type': query.data}
-            
-            message_text = "📝 Введіть деталі вашого замовлення:\n\n"
-            if query.data == 'in_stock':
-                message_text += "🏀 Що саме вас цікавить з наявності?\n"
-            else:
-                message_text += "📋 Що саме ви хочете замовити?\n"
-            
-            message_text += "\n💡 Можете прикріпити фото товару для кращого розуміння!"
-            
-            await query.edit_message_text(
-                message_text,
-                reply_markup=get_back_keyboard()
-            )
-            return ENTERING_ORDER
+        payment_text = "💳 Оберіть спосіб оплати:\n\n"
+        if query.data == 'cash_on_delivery':
+            payment_text += "💵 Накладний платіж - оплата при отриманні"
+        else:
+            payment_text += "💳 Передплата - оплата заздалегідь"
         
-        elif query.data in ['cash_on_delivery', 'prepayment']:
-            if user_id in user_data and 'order_type' in user_data[user_id]:
-                user_data[user_id]['payment_method'] = query.data
-                
-                payment_text = "💳 Оберіть спосіб оплати:\n\n"
-                if query.data == 'cash_on_delivery':
-                    payment_text += "💵 Накладний платіж - оплата при отриманні"
-                else:
-                    payment_text += "💳 Передплата - оплата заздалегідь"
-                
-                await query.edit_message_text(
-                    payment_text,
-                    reply_markup=get_back_keyboard()
-                )
-                
-                await query.message.reply_text(
-                    "📍 Введіть адресу доставки або відділення пошти:"
-                )
-                return ENTERING_ADDRESS
-            else:
-                # Якщо немає даних замовлення, повертаємося на головну
-                await query.edit_message_text(
-                    "❌ Помилка: спочатку створіть замовлення",
-                    reply_markup=get_main_keyboard()
-                )
-                return CHOOSING_OPTION
+        await outbox.send(
+            Priority.INTERACTIVE, query.edit_message_text,
+            payment_text,
+            reply_markup=get_back_keyboard()
+        )
         
-        elif query.data == 'confirm_order':
-            if user_id in user_data and all(key in user_data[user_id] for key in ['order_type', 'payment_method', 'address', 'order_details']):
-                order_data = user_data[user_id]
-                
-                # Додаємо інформацію про користувача
-                user = update.effective_user
-                order_data['username'] = user.username or "Невідомий"
-                order_data['first_name'] = user.first_name or "Невідомий"
-                
-                # Створюємо замовлення
-                order_id = db.add_order(user_id, order_data)
-                bot_stats['total_orders'] += 1
-                
-                # Відправляємо підтвердження користувачу
-                confirmation_text = f"""
+        await outbox.send(
+            Priority.INTERACTIVE, query.message.reply_text,
+            "📍 Введіть адресу доставки або відділення пошти:"
+        )
+        return ENTERING_ADDRESS
+    else:
+        # Якщо немає даних замовлення, повертаємося на головну
+        await outbox.send(
+            Priority.INTERACTIVE, query.edit_message_text,
+            "❌ Помилка: спочатку створіть замовлення",
+            reply_markup=get_main_keyboard()
+        )
+        return CHOOSING_OPTION
+
+async def place_order(update: Update, context: ContextTypes.DEFAULT_TYPE, draft_id: str) -> Optional[str]:
+    """Створення замовлення з чернетки та сповіщення адмінів (None, якщо чернетки немає)"""
+    user = update.effective_user
+    
+    # Замовлення вже створено (наприклад, до перезапуску бота)
+    order = db.get_order_by_draft(draft_id)
+    if order is not None and order.user_id == user.id:
+        return order.id
+    
+    order_data = user_data.get(user.id)
+    if (order_data is None or order_data.get('draft_id') != draft_id
+            or not all(key in order_data for key in ['order_type', 'payment_method', 'address', 'order_details'])):
+        return None
+    
+    # Додаємо інформацію про користувача
+    order_data['username'] = user.username or "Невідомий"
+    order_data['first_name'] = user.first_name or "Невідомий"
+    
+    # Створюємо замовлення
+    order_id = db.add_order(user.id, order_data)
+    bot_stats['total_orders'] += 1
+    
+    # Очищаємо дані користувача
+    user_data.pop(user.id, None)
+    
+    # Відправляємо повідомлення адміну у фоні, не затримуючи відповідь користувачу
+    context.application.create_task(send_admin_notification(context, order_id, user.id, order_data))
+    return order_id
+
+@callback_router.route('confirm_order')
+@callback_router.prefix('confirm_order')
+async def confirm_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, draft_id: str = None):
+    """Підтвердження замовлення"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    
+    # Кнопки без ключа (надіслані до оновлення) підтверджують поточну чернетку
+    draft_id = draft_id or user_data.get(user_id, {}).get('draft_id')
+    order_id = None
+    if draft_id:
+        order_id = await order_confirmations.run(
+            (user_id, draft_id), lambda: place_order(update, context, draft_id)
+        )
+    
+    if order_id is None:
+        # Якщо не всі дані заповнені
+        await outbox.send(
+            Priority.INTERACTIVE, query.edit_message_text,
+            "❌ Помилка: не всі дані замовлення заповнені",
+            reply_markup=get_main_keyboard()
+        )
+        return CHOOSING_OPTION
+    
+    # Відправляємо підтвердження користувачу (для повторних натискань - той самий текст)
+    order = db.get_order(order_id)
+    confirmation_text = f"""
 ✅ Ваше замовлення підтверджено!
 
 🆔 Номер замовлення: {order_id}
-📦 Тип: {'В наявності' if order_data['order_type'] == 'in_stock' else 'Під замовлення'}
-💳 Спосіб оплати: {'Накладний платіж' if order_data['payment_method'] == 'cash_on_delivery' else 'Передплата'}
-📍 Адреса: {order_data.get('address', 'Не вказано')}
-📝 Деталі: {order_data.get('order_details', 'Не вказано')}
+📦 Тип: {'В наявності' if order['order_type'] == 'in_stock' else 'Під замовлення'}
+💳 Спосіб оплати: {'Накладний платіж' if order['payment_method'] == 'cash_on_delivery' else 'Передплата'}
+📍 Адреса: {order['address'] or 'Не вказано'}
+📝 Деталі: {order['order_details'] or 'Не вказано'}
 
 🎉 Дякуємо за замовлення! Ми зв'яжемося з вами найближчим часом.
-                """
-                
-                await query.edit_message_text(
-                    confirmation_text,
-                    reply_markup=get_main_keyboard()
-                )
-                
-                # Відправляємо повідомлення адміну
-                await send_admin_notification(context, order_id, user_id, order_data)
-                
-                # Очищаємо дані користувача
-                if user_id in user_data:
-                    del user_data[user_id]
-                
-                return CHOOSING_OPTION
-            else:
-                # Якщо не всі дані заповнені
-                await query.edit_message_text(
-                    "❌ Помилка: не всі дані замовлення заповнені",
-                    reply_markup=get_main_keyboard()
-                )
-                return CHOOSING_OPTION
-        
-        elif query.data == 'admin_panel':
-            if user_id in ADMIN_IDS:
-                await query.edit_message_text(
-                    "🔧 Адмін панель\n\nОберіть дію:",
-                    reply_markup=get_admin_keyboard()
-                )
-            else:
-                await query.edit_message_text(
-                    "❌ У вас немає доступу до адмін панелі!",
-                    reply_markup=get_back_keyboard()
-                )
-        
-        elif query.data == 'admin_broadcast':
-            if user_id in ADMIN_IDS:
-                await query.edit_message_text(
-                    "📢 Розсилка\n\nОберіть тип розсилки:",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📝 Тільки текст", callback_data='broadcast_text_only')],
-                        [InlineKeyboardButton("📸 Фото з текстом", callback_data='broadcast_photo_text')],
-                        [InlineKeyboardButton("🔙 Назад", callback_data='admin_panel')]
-                    ])
-                )
-        
-        elif query.data == 'broadcast_text_only':
-            if user_id in ADMIN_IDS:
-                await query.edit_message_text(
-                    "📢 Розсилка тексту\n\nВведіть текст повідомлення для розсилки всім користувачам:",
-                    reply_markup=get_back_keyboard()
-                )
-                context.user_data['admin_state'] = 'waiting_broadcast_text'
-        
-        elif query.data == 'broadcast_photo_text':
-            if user_id in ADMIN_IDS:
-                await query.edit_message_text(
-                    "📸 Розсилка фото з текстом\n\nСпочатку прикріпіть фото:",
-                    reply_markup=get_back_keyboard()
-                )
-                context.user_data['admin_state'] = 'waiting_broadcast_photo'
-        
-        elif query.data == 'confirm_broadcast':
-            if user_id in ADMIN_IDS:
-                text = context.user_data.get('broadcast_text', '')
-                photo_file_id = context.user_data.get('broadcast_photo')
-                
-                if not text:
-                    await query.edit_message_text(
-                        "❌ Помилка: текст для розсилки не знайдено",
-                        reply_markup=get_admin_keyboard()
-                    )
-                    return
-                
-                # Виконуємо розсилку
-                await query.edit_message_text(
-                    "📢 Виконую розсилку...",
-                    reply_markup=get_back_keyboard()
-                )
-                
-                success_count, error_count = await execute_broadcast(context, text, photo_file_id)
-                
-                # Очищаємо дані розсилки
-                if 'broadcast_text' in context.user_data:
-                    del context.user_data['broadcast_text']
-                if 'broadcast_photo' in context.user_data:
-                    del context.user_data['broadcast_photo']
-                if 'admin_state' in context.user_data:
-                    del context.user_data['admin_state']
-                
-                result_text = f"""
-✅ Розсилка завершена!
+        """
+    await edit_view(query, confirmation_text, get_main_keyboard())
+    return CHOOSING_OPTION
 
-📊 Результат:
-✅ Успішно відправлено: {success_count}
-❌ Помилки: {error_count}
+@callback_router.prefix('my_orders')
+async def my_orders_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, page: str = '0'):
+    """Гортання історії замовлень"""
+    page = int(page) if page.isdigit() else 0
+    text, reply_markup = get_my_orders_view(update.callback_query.from_user.id, page)
+    await edit_view(update.callback_query, text, reply_markup)
 
-📢 Повідомлення відправлено всім користувачам
-                """
-                
-                await query.edit_message_text(
-                    result_text,
-                    reply_markup=get_admin_keyboard()
-                )
-        
-        elif query.data == 'change_broadcast':
-            if user_id in ADMIN_IDS:
-                # Очищаємо дані та повертаємося до вибору типу розсилки
-                if 'broadcast_text' in context.user_data:
-                    del context.user_data['broadcast_text']
-                if 'broadcast_photo' in context.user_data:
-                    del context.user_data['broadcast_photo']
-                
-                await query.edit_message_text(
-                    "📢 Розсилка\n\nОберіть тип розсилки:",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📝 Тільки текст", callback_data='broadcast_text_only')],
-                        [InlineKeyboardButton("📸 Фото з текстом", callback_data='broadcast_photo_text')],
-                        [InlineKeyboardButton("🔙 Назад", callback_data='admin_panel')]
-                    ])
-                )
-        
-        elif query.data == 'admin_view_orders':
-            if user_id in ADMIN_IDS:
-                orders = db.get_recent_orders(10)
-                if orders:
-                    orders_text = "📋 Останні 10 замовлень:\n\n"
-                    for order in orders:
-                        orders_text += f"""
-🆔 {order['id']}
-👤 {order['first_name']} (@{order['username']})
-📅 {order['created_date'][:10]}
-📦 {'В наявності' if order['order_data']['order_type'] == 'in_stock' else 'Під замовлення'}
-💳 {'Накладний платіж' if order['order_data']['payment_method'] == 'cash_on_delivery' else 'Передплата'}
-📍 {order['order_data'].get('address', 'Не вказано')}
-📝 {order['order_data'].get('order_details', 'Не вказано')}
-🔗 ID користувача: {order['user_id']}
-                        """
-                        orders_text += "\n" + "─" * 50 + "\n"
-                    
-                    orders_text += "\n💬 Для відправки повідомлення замовнику використовуйте:\n"
-                    orders_text += "/message НОМЕР_ЗАМОВЛЕННЯ ТЕКСТ_ПОВІДОМЛЕННЯ"
-                    
-                    # Розбиваємо на частини, якщо текст занадто довгий
-                    if len(orders_text) > 4096:
-                        for i in range(0, len(orders_text), 4096):
-                            await query.message.reply_text(orders_text[i:i+4096])
-                    else:
-                        await query.edit_message_text(orders_text, reply_markup=get_admin_keyboard())
-                else:
-                    await query.edit_message_text(
-                        "📭 Поки що немає замовлень",
-                        reply_markup=get_admin_keyboard()
-                    )
-        
-        elif query.data == 'admin_stats':
-            if user_id in ADMIN_IDS:
-                uptime_hours = (datetime.now() - bot_stats['start_time']).total_seconds() / 3600
-                stats_text = f"""
-📊 Статистика бота:
+@callback_router.route('admin_panel', admin=True, on_denied=deny_admin_callback)
+async def admin_panel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Адмін панель"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "🔧 Адмін панель\n\nОберіть дію:",
+        reply_markup=get_admin_keyboard()
+    )
 
-⏰ Час роботи: {uptime_hours:.1f} годин
-👥 Всього користувачів: {bot_stats['total_users']}
-📦 Всього замовлень: {bot_stats['total_orders']}
-❌ Помилок: {bot_stats['errors']}
-🔄 Статус: Активний
-                """
-                
-                await query.edit_message_text(
-                    stats_text,
-                    reply_markup=get_admin_keyboard()
-                )
+@callback_router.route('admin_broadcast', admin=True)
+async def admin_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вибір типу розсилки"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "📢 Розсилка\n\nОберіть тип розсилки:",
+        reply_markup=get_broadcast_type_keyboard()
+    )
+
+@callback_router.route('broadcast_text_only', admin=True)
+async def broadcast_text_only_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Розсилка тексту"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "📢 Розсилка тексту\n\nВведіть текст повідомлення для розсилки:",
+        reply_markup=get_back_keyboard()
+    )
+    context.user_data['admin_state'] = 'waiting_broadcast_text'
+
+@callback_router.route('broadcast_photo_text', admin=True)
+async def broadcast_photo_text_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Розсилка фото з текстом"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "📸 Розсилка фото з текстом\n\nСпочатку прикріпіть фото:",
+        reply_markup=get_back_keyboard()
+    )
+    context.user_data['admin_state'] = 'waiting_broadcast_photo'
+
+@callback_router.route('confirm_broadcast', admin=True)
+async def confirm_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Негайне виконання розсилки"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    text = context.user_data.get('broadcast_text', '')
+    
+    if not text:
+        await outbox.send(
+            Priority.INTERACTIVE, query.edit_message_text,
+            "❌ Помилка: текст для розсилки не знайдено",
+            reply_markup=get_admin_keyboard()
+        )
+        return
+    
+    selection = context.user_data.get('broadcast_segments', {})
+    broadcast_id = create_broadcast(context, user_id, datetime.now())
+    clear_broadcast_draft(context)
+    
+    # Розсилка йде у фоновому завданні, щоб не блокувати обробку оновлень (і /cancel_broadcast)
+    schedule_broadcast_job(context.application, broadcast_id, 0)
+    
+    await outbox.send(
+        Priority.INTERACTIVE, query.edit_message_text,
+        f"📢 Розсилку {broadcast_id} запущено.\n\n"
+        f"🎯 Аудиторія:\n{describe_broadcast_audience(selection)}\n\n"
+        f"Про завершення буде повідомлено окремо. Скасувати: /cancel_broadcast {broadcast_id}",
+        reply_markup=get_admin_keyboard()
+    )
+
+@callback_router.route('schedule_broadcast', admin=True)
+async def schedule_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запит часу запланованої розсилки"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "⏰ Введіть час розсилки у форматі ГГ:ХХ або ДД.ММ.РРРР ГГ:ХХ:",
+        reply_markup=get_back_keyboard()
+    )
+    context.user_data['admin_state'] = 'waiting_broadcast_time'
+
+@callback_router.route('offpeak_broadcast', admin=True)
+async def offpeak_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Планування розсилки на непіковий час"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    
+    if not context.user_data.get('broadcast_text'):
+        await outbox.send(
+            Priority.INTERACTIVE, query.edit_message_text,
+            "❌ Помилка: текст для розсилки не знайдено",
+            reply_markup=get_admin_keyboard()
+        )
+        return
+    
+    run_at = next_off_peak_start(datetime.now())
+    broadcast_id = create_broadcast(context, user_id, run_at, off_peak=True)
+    schedule_broadcast_job(context.application, broadcast_id, (run_at - datetime.now()).total_seconds())
+    clear_broadcast_draft(context)
+    
+    await outbox.send(
+        Priority.INTERACTIVE, query.edit_message_text,
+        f"🌙 Розсилку {broadcast_id} заплановано на непіковий час "
+        f"({OFF_PEAK_START_HOUR:02d}:00-{OFF_PEAK_END_HOUR:02d}:00), початок: {run_at:%d.%m.%Y %H:%M}\n\n"
+        "📋 Список: /scheduled",
+        reply_markup=get_admin_keyboard()
+    )
+
+@callback_router.route('change_broadcast', admin=True)
+async def change_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Скасування чернетки та повернення до вибору типу розсилки"""
+    for key in ('broadcast_text', 'broadcast_photo', 'broadcast_segments'):
+        context.user_data.pop(key, None)
+    
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "📢 Розсилка\n\nОберіть тип розсилки:",
+        reply_markup=get_broadcast_type_keyboard()
+    )
+
+@callback_router.route('broadcast_segments', admin=True)
+async def broadcast_segments_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вибір аудиторії розсилки"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        "🎯 Аудиторія розсилки\n\nНатискайте на сегмент: ➕ включити (хоча б один з ➕), "
+        "🔗 обов'язково (кожен з 🔗), ➖ виключити, ще раз - скинути.",
+        reply_markup=get_segment_keyboard(get_broadcast_segment_options(context))
+    )
+
+@callback_router.prefix('bseg', admin=True)
+async def toggle_segment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, key: str = ''):
+    """Перемикання сегмента аудиторії"""
+    if key in BROADCAST_SEGMENTS:
+        selection = context.user_data.setdefault('broadcast_segments', {})
+        # Циклічне перемикання: включити -> обов'язково -> виключити -> скинути
+        mode = selection.get(key)
+        if mode is None:
+            selection[key] = 'include'
+        elif mode == 'include':
+            selection[key] = 'require'
+        elif mode == 'require':
+            selection[key] = 'exclude'
+        else:
+            del selection[key]
+    
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_reply_markup,
+        reply_markup=get_segment_keyboard(get_broadcast_segment_options(context))
+    )
+
+@callback_router.route('bseg_done', admin=True)
+async def segments_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Повернення до підтвердження розсилки"""
+    await outbox.send(
+        Priority.INTERACTIVE, update.callback_query.edit_message_text,
+        broadcast_confirmation_text(context),
+        reply_markup=get_broadcast_confirm_keyboard()
+    )
+
+@callback_router.route('admin_view_orders', admin=True)
+async def admin_view_orders_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Останні замовлення"""
+    query = update.callback_query
+    orders_text = view_cache.get_or_render(('recent_orders', 10), db.version, lambda: render_recent_orders(10))
+    if orders_text:
+        # Розбиваємо на частини, якщо текст занадто довгий
+        if len(orders_text) > 4096:
+            for i in range(0, len(orders_text), 4096):
+                await outbox.send(Priority.INTERACTIVE, query.message.reply_text, orders_text[i:i+4096])
+        else:
+            await edit_view(query, orders_text, get_admin_keyboard())
+    else:
+        await edit_view(query, "📭 Поки що немає замовлень", get_admin_keyboard())
+
+@callback_router.route('admin_stats', admin=True)
+async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Статистика бота"""
+    await edit_view(update.callback_query, get_stats_view(), get_admin_keyboard())
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник натискань кнопок"""
+    try:
+        query = update.callback_query
+        await outbox.send(Priority.INTERACTIVE, query.answer)
+        
+        return await callback_router.dispatch(update, context)
     
     except Exception as e:
         logger.error(f"Помилка в button_handler: {e}")
         bot_stats['errors'] += 1
         try:
-            await query.edit_message_text(
+            await outbox.send(
+                Priority.INTERACTIVE, query.edit_message_text,
                 "❌ Помилка обробки запиту. Спробуйте ще раз.",
                 reply_markup=get_main_keyboard()
             )
@@ -379,10 +885,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if user_id in ADMIN_IDS and context.user_data.get('admin_state') == 'waiting_broadcast_text':
             await handle_broadcast_confirmation(update, context)
             return
+        if user_id in ADMIN_IDS and context.user_data.get('admin_state') == 'waiting_broadcast_time':
+            await handle_broadcast_schedule(update, context)
+            return
         
         # Обробка кнопки "Назад"
         if text == "🔙 Назад":
-            await update.message.reply_text(
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
                 WELCOME_MESSAGE,
                 reply_markup=get_main_keyboard()
             )
@@ -392,7 +902,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if user_id in user_data and 'order_type' in user_data[user_id] and 'order_details' not in user_data[user_id]:
             user_data[user_id]['order_details'] = text
             
-            await update.message.reply_text(
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
                 "💳 Тепер оберіть спосіб оплати:",
                 reply_markup=get_payment_keyboard()
             )
@@ -415,14 +926,16 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ✅ Все правильно? Підтвердіть замовлення:
             """
             
-            await update.message.reply_text(
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
                 summary_text,
-                reply_markup=get_confirm_keyboard()
+                reply_markup=get_confirm_keyboard(order_data.setdefault('draft_id', uuid.uuid4().hex))
             )
             return CONFIRMING_ORDER
         
         # Якщо не впізнали повідомлення, повертаємося на головну
-        await update.message.reply_text(
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
             "❓ Не зрозумів ваше повідомлення. Повертаюся на головну.",
             reply_markup=get_main_keyboard()
         )
@@ -431,7 +944,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Помилка в handle_message: {e}")
         bot_stats['errors'] += 1
-        await update.message.reply_text(
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
             "❌ Помилка обробки повідомлення. Спробуйте ще раз.",
             reply_markup=get_main_keyboard()
         )
@@ -451,13 +965,15 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 user_data[user_id]['photos'] = []
             user_data[user_id]['photos'].append(file_id)
             
-            await update.message.reply_text(
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
                 "📸 Фото додано! Тепер введіть деталі замовлення:"
             )
     except Exception as e:
         logger.error(f"Помилка в handle_photo: {e}")
         bot_stats['errors'] += 1
-        await update.message.reply_text(
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
             "❌ Помилка обробки фото. Спробуйте ще раз."
         )
 
@@ -469,17 +985,58 @@ async def handle_broadcast_confirmation(update: Update, context: ContextTypes.DE
         
         context.user_data['broadcast_text'] = text
         
-        await update.message.reply_text(
-            f"📢 Текст для розсилки:\n\n{text}\n\n✅ Все правильно? Відправляємо?",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Так, відправити", callback_data='confirm_broadcast')],
-                [InlineKeyboardButton("❌ Ні, змінити", callback_data='change_broadcast')]
-            ])
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
+            broadcast_confirmation_text(context),
+            reply_markup=get_broadcast_confirm_keyboard()
         )
     except Exception as e:
         logger.error(f"Помилка в handle_broadcast_confirmation: {e}")
         bot_stats['errors'] += 1
 
+async def handle_broadcast_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Планування розсилки на вказаний час"""
+    try:
+        user_id = update.effective_user.id
+        run_at = parse_broadcast_time(update.message.text)
+        
+        if run_at is None:
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
+                "❌ Неправильний формат часу! Використовуйте ГГ:ХХ або ДД.ММ.РРРР ГГ:ХХ"
+            )
+            return
+        
+        # Дата в минулому інакше призвела б до негайної розсилки без попередження
+        if run_at <= datetime.now():
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
+                "❌ Цей час уже минув! Вкажіть майбутній час у форматі ГГ:ХХ або ДД.ММ.РРРР ГГ:ХХ"
+            )
+            return
+        
+        if not context.user_data.get('broadcast_text'):
+            clear_broadcast_draft(context)
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
+                "❌ Помилка: текст для розсилки не знайдено",
+                reply_markup=get_admin_keyboard()
+            )
+            return
+        
+        broadcast_id = create_broadcast(context, user_id, run_at)
+        schedule_broadcast_job(context.application, broadcast_id, (run_at - datetime.now()).total_seconds())
+        clear_broadcast_draft(context)
+        
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
+            f"⏰ Розсилку {broadcast_id} заплановано на {run_at:%d.%m.%Y %H:%M}\n\n📋 Список: /scheduled",
+            reply_markup=get_admin_keyboard()
+        )
+    except Exception as e:
+        logger.error(f"Помилка в handle_broadcast_schedule: {e}")
+        bot_stats['errors'] += 1
+
 async def handle_broadcast_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробник фото для розсилки"""
     try:
@@ -491,7 +1048,8 @@ async def handle_broadcast_photo(update: Update, context: ContextTypes.DEFAULT_T
             
             context.user_data['broadcast_photo'] = file_id
             
-            await update.message.reply_text(
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
                 "📸 Фото додано! Тепер введіть текст для розсилки:"
             )
             context.user_data['admin_state'] = 'waiting_broadcast_text'
@@ -499,42 +1057,82 @@ async def handle_broadcast_photo(update: Update, context: ContextTypes.DEFAULT_T
         logger.error(f"Помилка в handle_broadcast_photo: {e}")
         bot_stats['errors'] += 1
 
-async def execute_broadcast(context: ContextTypes.DEFAULT_TYPE, text: str, photo_file_id: str = None):
-    """Виконання розсилки всім користувачам"""
+def broadcast_pause_delay(broadcast: dict):
+    """Через скільки секунд відновити розсилку, якщо її треба призупинити"""
+    now = datetime.now()
+    if broadcast.get('off_peak') and not is_off_peak(now):
+        return (next_off_peak_start(now) - now).total_seconds()
+    if current_update_rate() > BROADCAST_MAX_UPDATE_RATE:
+        return BROADCAST_PAUSE_SECONDS
+    return None
+
+async def execute_broadcast(context: ContextTypes.DEFAULT_TYPE, broadcast_id: str):
+    """Виконання розсилки зі збереженням прогресу; повертає затримку до відновлення, якщо її призупинено"""
     try:
-        users = db.get_all_users()
-        success_count = 0
-        error_count = 0
+        broadcast = db.get_broadcast(broadcast_id)
+        if broadcast is None:
+            return None
+        
+        # Аудиторія фіксується на момент старту, щоб прогрес можна було відновити
+        recipients = db.get_broadcast_recipients(broadcast_id)
+        if recipients is None:
+            recipients = sorted(resolve_broadcast_audience(broadcast.get('segments', {})))
+            db.set_broadcast_recipients(broadcast_id, recipients)
+        broadcast['status'] = 'running'
+        db.save_broadcasts()
         
-        for user in users:
+        while broadcast['offset'] < len(recipients):
+            # Розсилку скасовано
+            if db.get_broadcast(broadcast_id) is None:
+                return None
+            
+            # Бот зупиняється: зберігаємо прогрес, розсилка продовжиться після перезапуску
+            if is_shutting_down():
+                broadcast['status'] = 'interrupted'
+                db.save_broadcasts()
+                logger.info(f"Розсилку {broadcast_id} перервано на {broadcast['offset']}/{len(recipients)}")
+                return 0.0
+            
+            delay = broadcast_pause_delay(broadcast)
+            if delay is not None:
+                broadcast['status'] = 'paused'
+                db.save_broadcasts()
+                logger.info(f"Розсилку {broadcast_id} призупинено на {delay:.0f} с")
+                return delay
+            
+            recipient_id = recipients[broadcast['offset']]
             try:
-                if photo_file_id:
+                if broadcast.get('photo'):
                     # Відправляємо фото з текстом
-                    await context.bot.send_photo(
-                        chat_id=user['user_id'],
-                        photo=photo_file_id,
-                        caption=text
+                    await outbox.send(
+                        Priority.BROADCAST, context.bot.send_photo,
+                        chat_id=recipient_id,
+                        photo=broadcast['photo'],
+                        caption=broadcast['text']
                     )
                 else:
                     # Відправляємо тільки текст
-                    await context.bot.send_message(
-                        chat_id=user['user_id'],
-                        text=text
+                    await outbox.send(
+                        Priority.BROADCAST, context.bot.send_message,
+                        chat_id=recipient_id,
+                        text=broadcast['text']
                     )
-                success_count += 1
-                
-                # Невелика затримка для уникнення спаму
-                await asyncio.sleep(0.1)
+                broadcast['success_count'] += 1
                 
             except Exception as e:
-                error_count += 1
-                logger.error(f"Помилка відправки розсилки користувачу {user['user_id']}: {e}")
+                broadcast['error_count'] += 1
+                logger.error(f"Помилка відправки розсилки користувачу {recipient_id}: {e}")
+            
+            broadcast['offset'] += 1
+            if broadcast['offset'] % BROADCAST_CHECKPOINT_EVERY == 0:
+                db.save_broadcasts()
         
-        return success_count, error_count
+        db.save_broadcasts()
+        return None
     except Exception as e:
         logger.error(f"Помилка в execute_broadcast: {e}")
         bot_stats['errors'] += 1
-        return 0, 0
+        return None
 
 async def send_admin_notification(context: ContextTypes.DEFAULT_TYPE, order_id: str, user_id: int, order_data: dict):
     """Відправка повідомлення адміну про нове замовлення"""
@@ -556,7 +1154,8 @@ async def send_admin_notification(context: ContextTypes.DEFAULT_TYPE, order_id:
         
         for admin_id in ADMIN_IDS:
             try:
-                await context.bot.send_message(
+                await outbox.send(
+                    Priority.ADMIN, context.bot.send_message,
                     chat_id=admin_id,
                     text=admin_message,
                     parse_mode=ParseMode.HTML
@@ -573,12 +1172,13 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
         if user_id in ADMIN_IDS:
-            await update.message.reply_text(
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
                 "🔧 Адмін панель\n\nОберіть дію:",
                 reply_markup=get_admin_keyboard()
             )
         else:
-            await update.message.reply_text("❌ У вас немає доступу до адмін панелі!")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до адмін панелі!")
     except Exception as e:
         logger.error(f"Помилка в admin_command: {e}")
         bot_stats['errors'] += 1
@@ -589,11 +1189,12 @@ async def message_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
         if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас немає доступу до цієї команди!")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
             return
         
         if not context.args or len(context.args) < 2:
-            await update.message.reply_text(
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
                 "❌ Неправильний формат! Використовуйте:\n"
                 "/message НОМЕР_ЗАМОВЛЕННЯ ТЕКСТ_ПОВІДОМЛЕННЯ"
             )
@@ -604,49 +1205,155 @@ async def message_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         order = db.get_order(order_id)
         if not order:
-            await update.message.reply_text("❌ Замовлення не знайдено!")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ Замовлення не знайдено!")
             return
         
         try:
-            await context.bot.send_message(
+            await outbox.send(
+                Priority.RELAY, context.bot.send_message,
                 chat_id=order['user_id'],
                 text=f"💬 Повідомлення від {SHOP_NAME}:\n\n{message_text}"
             )
-            await update.message.reply_text(f"✅ Повідомлення відправлено замовнику {order_id}")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, f"✅ Повідомлення відправлено замовнику {order_id}")
         except Exception as e:
-            await update.message.reply_text(f"❌ Помилка відправки: {e}")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, f"❌ Помилка відправки: {e}")
     except Exception as e:
         logger.error(f"Помилка в message_command: {e}")
         bot_stats['errors'] += 1
 
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /status для адмінів - зміна статусу замовлення"""
+    try:
+        user_id = update.effective_user.id
+        
+        if user_id not in ADMIN_IDS:
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
+            return
+        
+        if not context.args or len(context.args) < 2:
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
+                "❌ Неправильний формат! Використовуйте:\n"
+                "/status НОМЕР_ЗАМОВЛЕННЯ НОВИЙ_СТАТУС"
+            )
+            return
+        
+        order_id = context.args[0]
+        status = ' '.join(context.args[1:])
+        
+        # Новий статус інвалідує кешовані екрани замовлень (адмінський і /my_orders клієнта)
+        if not db.set_order_status(order_id, status):
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ Замовлення не знайдено!")
+            return
+        
+        order = db.get_order(order_id)
+        try:
+            await outbox.send(
+                Priority.RELAY, context.bot.send_message,
+                chat_id=order['user_id'],
+                text=f"📌 Статус замовлення {order_id}: {status}\n\n🧾 Усі замовлення: /my_orders"
+            )
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, f"✅ Статус {order_id} змінено на «{status}»")
+        except Exception as e:
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
+                f"✅ Статус {order_id} змінено, але замовника не сповіщено: {e}"
+            )
+    except Exception as e:
+        logger.error(f"Помилка в status_command: {e}")
+        bot_stats['errors'] += 1
+
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /broadcast для адмінів"""
     try:
         user_id = update.effective_user.id
         
         if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас немає доступу до цієї команди!")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
             return
         
-        await update.message.reply_text(
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
             "📢 Розсилка\n\nОберіть тип розсилки:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📝 Тільки текст", callback_data='broadcast_text_only')],
-                [InlineKeyboardButton("📸 Фото з текстом", callback_data='broadcast_photo_text')],
-                [InlineKeyboardButton("🔙 Назад", callback_data='admin_panel')]
-            ])
+            reply_markup=get_broadcast_type_keyboard()
         )
     except Exception as e:
         logger.error(f"Помилка в broadcast_command: {e}")
         bot_stats['errors'] += 1
 
+async def scheduled_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /scheduled - список запланованих розсилок"""
+    try:
+        user_id = update.effective_user.id
+        
+        if user_id not in ADMIN_IDS:
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
+            return
+        
+        if not db.broadcasts:
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "📭 Немає запланованих розсилок")
+            return
+        
+        text = "⏰ Заплановані розсилки:\n\n"
+        for broadcast_id, broadcast in db.broadcasts.items():
+            run_at = datetime.fromisoformat(broadcast['run_at'])
+            progress = ""
+            if broadcast.get('total') is not None:
+                progress = f"\n📊 Прогрес: {broadcast['offset']}/{broadcast['total']}"
+            text += (
+                f"🆔 {broadcast_id} ({broadcast['status']})\n"
+                f"📅 {run_at:%d.%m.%Y %H:%M}{' 🌙' if broadcast.get('off_peak') else ''}\n"
+                f"🎯 {describe_broadcast_audience(broadcast.get('segments', {}))}{progress}\n"
+                f"📝 {broadcast['text'][:100]}\n\n"
+            )
+        text += "❌ Скасувати: /cancel_broadcast НОМЕР"
+        
+        for i in range(0, len(text), 4096):
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, text[i:i+4096])
+    except Exception as e:
+        logger.error(f"Помилка в scheduled_command: {e}")
+        bot_stats['errors'] += 1
+
+async def cancel_broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /cancel_broadcast - скасування запланованої розсилки"""
+    try:
+        user_id = update.effective_user.id
+        
+        if user_id not in ADMIN_IDS:
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
+            return
+        
+        if not context.args:
+            await outbox.send(
+                Priority.INTERACTIVE, update.message.reply_text,
+                "❌ Неправильний формат! Використовуйте:\n/cancel_broadcast НОМЕР"
+            )
+            return
+        
+        broadcast_id = context.args[0]
+        broadcast = db.remove_broadcast(broadcast_id)
+        if broadcast is None:
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ Розсилку не знайдено!")
+            return
+        
+        for job in context.job_queue.get_jobs_by_name(f"broadcast:{broadcast_id}"):
+            job.schedule_removal()
+        
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
+            f"✅ Розсилку {broadcast_id} скасовано (відправлено {broadcast['success_count']})"
+        )
+    except Exception as e:
+        logger.error(f"Помилка в cancel_broadcast_command: {e}")
+        bot_stats['errors'] += 1
+
 async def view_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /view_users для адмінів"""
     try:
         user_id = update.effective_user.id
         
         if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас немає доступу до цієї команди!")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
             return
         
         users = db.get_all_users()
@@ -664,11 +1371,11 @@ async def view_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             # Розбиваємо на частини, якщо текст занадто довгий
             if len(users_text) > 4096:
                 for i in range(0, len(users_text), 4096):
-                    await update.message.reply_text(users_text[i:i+4096])
+                    await outbox.send(Priority.INTERACTIVE, update.message.reply_text, users_text[i:i+4096])
             else:
-                await update.message.reply_text(users_text)
+                await outbox.send(Priority.INTERACTIVE, update.message.reply_text, users_text)
         else:
-            await update.message.reply_text("📭 Поки що немає користувачів")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "📭 Поки що немає користувачів")
     except Exception as e:
         logger.error(f"Помилка в view_users_command: {e}")
         bot_stats['errors'] += 1
@@ -679,98 +1386,199 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
         if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас немає доступу до цієї команди!")
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
             return
         
-        uptime_hours = (datetime.now() - bot_stats['start_time']).total_seconds() / 3600
-        stats_text = f"""
-📊 Статистика бота:
+        stats_text = f"""{get_stats_view()}
 
-⏰ Час роботи: {uptime_hours:.1f} годин
-👥 Всього користувачів: {bot_stats['total_users']}
-📦 Всього замовлень: {bot_stats['total_orders']}
-❌ Помилок: {bot_stats['errors']}
-🔄 Статус: Активний
+{format_outbound_metrics()}
+
+{format_route_metrics()}
+
+🗂 Кеш екранів: влучань {view_cache.hits}, промахів {view_cache.misses}, пропущених редагувань {view_cache.skipped_edits}
+🧾 Кеш історії замовлень: влучань {my_orders_cache.hits}, промахів {my_orders_cache.misses}
+🔁 Підтвердження замовлень: виконано {order_confirmations.executed}, об'єднано {order_confirmations.collapsed}, повторів {order_confirmations.replayed}
         """
         
-        await update.message.reply_text(stats_text)
+        await outbox.send(Priority.INTERACTIVE, update.message.reply_text, stats_text)
     except Exception as e:
         logger.error(f"Помилка в stats_command: {e}")
         bot_stats['errors'] += 1
 
+async def my_orders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /my_orders - історія замовлень клієнта"""
+    try:
+        text, reply_markup = get_my_orders_view(update.effective_user.id, 0)
+        await outbox.send(Priority.INTERACTIVE, update.message.reply_text, text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Помилка в my_orders_command: {e}")
+        bot_stats['errors'] += 1
+        await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ Помилка отримання замовлень")
+
 async def ping_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /ping для перевірки роботи бота"""
     try:
         start_time = datetime.now()
-        await update.message.reply_text("🏓 Pong!")
+        await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "🏓 Pong!")
         end_time = datetime.now()
         
         response_time = (end_time - start_time).total_seconds() * 1000
         
-        await update.message.reply_text(f"⏱️ Час відповіді: {response_time:.2f} мс")
+        await outbox.send(Priority.INTERACTIVE, update.message.reply_text, f"⏱️ Час відповіді: {response_time:.2f} мс")
     except Exception as e:
         logger.error(f"Помилка в ping_command: {e}")
         bot_stats['errors'] += 1
 
-def main():
-    """Головна функція"""
+async def profile_and_report(context: ContextTypes.DEFAULT_TYPE, chat_id: int, seconds: int):
+    """Профілювання у фоні та відправка результатів адміну"""
     try:
-        # Налаштування сигналів для граціозного завершення
-        loop = asyncio.get_event_loop()
-        for sig in (signal.SIGTERM, signal.SIGINT):
-            loop.add_signal_handler(sig, lambda s=sig: asyncio.create_task(graceful_shutdown(s, loop)))
-        
-        # Створюємо застосунок
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        # Додаємо обробники
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', start)],
-            states={
-                CHOOSING_OPTION: [
-                    CallbackQueryHandler(button_handler),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
-                ],
-                ENTERING_ORDER: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message),
-                    MessageHandler(filters.PHOTO, handle_photo),
-                    CallbackQueryHandler(button_handler)
-                ],
-                CHOOSING_PAYMENT: [
-                    CallbackQueryHandler(button_handler),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
-                ],
-                ENTERING_ADDRESS: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message),
-                    CallbackQueryHandler(button_handler)
-                ],
-                CONFIRMING_ORDER: [
-                    CallbackQueryHandler(button_handler),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
-                ]
-            },
-            fallbacks=[CommandHandler('start', start)]
+        started = datetime.now()
+        report, data = await run_profile(seconds)
+        elapsed = (datetime.now() - started).total_seconds()
+        
+        text = f"🔬 Профіль за {elapsed:.0f} с (топ за кумулятивним часом):\n\n{report}"
+        for i in range(0, len(text), 4096):
+            await outbox.send(Priority.ADMIN, context.bot.send_message, chat_id=chat_id, text=text[i:i+4096])
+        
+        await outbox.send(
+            Priority.ADMIN, context.bot.send_document,
+            chat_id=chat_id,
+            document=InputFile(data, filename=f"profile_{started:%Y%m%d_%H%M%S}.prof"),
+            caption="📎 Відкрийте через pstats або snakeviz"
         )
+    except Exception as e:
+        logger.error(f"Помилка в profile_and_report: {e}")
+        bot_stats['errors'] += 1
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /profile для адмінів - профілювання бота на вказаний час"""
+    try:
+        user_id = update.effective_user.id
         
-        application.add_handler(conv_handler)
+        if user_id not in ADMIN_IDS:
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "❌ У вас немає доступу до цієї команди!")
+            return
+        
+        seconds = PROFILE_DEFAULT_SECONDS
+        if context.args:
+            if not context.args[0].isdigit() or not 0 < int(context.args[0]) <= PROFILE_MAX_SECONDS:
+                await outbox.send(
+                    Priority.INTERACTIVE, update.message.reply_text,
+                    f"❌ Неправильний формат! Використовуйте:\n/profile СЕКУНДИ (1-{PROFILE_MAX_SECONDS})"
+                )
+                return
+            seconds = int(context.args[0])
+        
+        if is_profiling():
+            await outbox.send(Priority.INTERACTIVE, update.message.reply_text, "⏳ Профілювання вже виконується")
+            return
         
-        # Додаємо обробник фото для розсилки (поза ConversationHandler)
-        application.add_handler(MessageHandler(filters.PHOTO, handle_broadcast_photo))
+        # Запускаємо у фоні, щоб не блокувати обробку інших оновлень
+        context.application.create_task(profile_and_report(context, update.effective_chat.id, seconds))
         
-        # Додаємо команди адміна
-        application.add_handler(CommandHandler('admin', admin_command))
-        application.add_handler(CommandHandler('message', message_command))
-        application.add_handler(CommandHandler('broadcast', broadcast_command))
-        application.add_handler(CommandHandler('view_users', view_users_command))
-        application.add_handler(CommandHandler('stats', stats_command))
-        application.add_handler(CommandHandler('ping', ping_command))
+        await outbox.send(
+            Priority.INTERACTIVE, update.message.reply_text,
+            f"🔬 Профілювання запущено на {seconds} с. Результат надійде після завершення."
+        )
+    except Exception as e:
+        logger.error(f"Помилка в profile_command: {e}")
+        bot_stats['errors'] += 1
+
+def build_application(request: Optional[BaseRequest] = None) -> Application:
+    """Створення застосунку з усіма обробниками (request - власний HTTP-шар, напр. для soak-тесту)"""
+    # Стан розмов і context.user_data зберігаються між перезапусками
+    persistence = PicklePersistence(
+        filepath='bot_state.pickle',
+        store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+        # Файли стану (цей і sessions.json) пишуться лише при зупинці, а не на кожну зміну.
+        # Після збою вони були б застарілими, тому обидва видаляються одразу після завантаження:
+        # краще почати розмови заново, ніж відновити їх на середині
+        on_flush=True
+    )
+    
+    # Створюємо застосунок
+    builder = (
+        Application.builder()
+        .application_class(BotApplication)
+        .token(BOT_TOKEN)
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    
+    # Додаємо обробники
+    conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('start', traced_handler(start))],
+        states={
+            CHOOSING_OPTION: [
+                CallbackQueryHandler(traced_handler(button_handler)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, traced_handler(handle_message))
+            ],
+            ENTERING_ORDER: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, traced_handler(handle_message)),
+                MessageHandler(filters.PHOTO, traced_handler(handle_photo)),
+                CallbackQueryHandler(traced_handler(button_handler))
+            ],
+            CHOOSING_PAYMENT: [
+                CallbackQueryHandler(traced_handler(button_handler)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, traced_handler(handle_message))
+            ],
+            ENTERING_ADDRESS: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, traced_handler(handle_message)),
+                CallbackQueryHandler(traced_handler(button_handler))
+            ],
+            CONFIRMING_ORDER: [
+                CallbackQueryHandler(traced_handler(button_handler)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, traced_handler(handle_message))
+            ]
+        },
+        fallbacks=[CommandHandler('start', traced_handler(start))],
+        name='order_conversation',
+        persistent=True
+    )
+    
+    # Облік навантаження для пауз розсилок
+    application.add_handler(TypeHandler(Update, track_update), group=-1)
+    
+    application.add_handler(conv_handler)
+    
+    # Додаємо обробник фото для розсилки (поза ConversationHandler)
+    application.add_handler(MessageHandler(filters.PHOTO, traced_handler(handle_broadcast_photo)))
+    
+    # Історія замовлень клієнта (гортання працює і поза розмовою оформлення)
+    application.add_handler(CommandHandler('my_orders', traced_handler(my_orders_command)))
+    application.add_handler(CallbackQueryHandler(traced_handler(button_handler), pattern='^my_orders:'))
+    
+    # Додаємо команди адміна
+    application.add_handler(CommandHandler('admin', traced_handler(admin_command)))
+    application.add_handler(CommandHandler('message', traced_handler(message_command)))
+    application.add_handler(CommandHandler('status', traced_handler(status_command)))
+    application.add_handler(CommandHandler('broadcast', traced_handler(broadcast_command)))
+    application.add_handler(CommandHandler('scheduled', traced_handler(scheduled_command)))
+    application.add_handler(CommandHandler('cancel_broadcast', traced_handler(cancel_broadcast_command)))
+    application.add_handler(CommandHandler('view_users', traced_handler(view_users_command)))
+    application.add_handler(CommandHandler('stats', traced_handler(stats_command)))
+    application.add_handler(CommandHandler('ping', traced_handler(ping_command)))
+    application.add_handler(CommandHandler('profile', traced_handler(profile_command)))
+    
+    return application
+
+def main():
+    """Головна функція"""
+    try:
+        application = build_application()
         
         # Запускаємо бота
         logger.info("🚀 Бот запущений!")
         logger.info(f"👥 Адміністратори: {ADMIN_IDS}")
         logger.info(f"🏀 Назва магазину: {SHOP_NAME}")
         
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Сигнали обробляє graceful_shutdown (встановлюється в post_init)
+        application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
         
     except Exception as e:
         logger.error(f"Критична помилка в main: {e}")
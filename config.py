@@ -4,3 +4,28 @@
     'view_orders': '📋 Переглянути замовлення',
     'back_to_main': '🔙 На головну'
 }
+
+# Планувальник вихідних повідомлень
+OUTBOUND_RATE = 25  # повідомлень на секунду для всього бота
+OUTBOUND_MAX_RETRIES = 5
+
+# Заплановані розсилки
+OFF_PEAK_START_HOUR = 10  # початок години з найменшим навантаженням
+OFF_PEAK_END_HOUR = 12
+BROADCAST_MAX_UPDATE_RATE = 2.0  # оновлень на секунду, вище якого розсилка стає на паузу
+BROADCAST_PAUSE_SECONDS = 120
+BROADCAST_CHECKPOINT_EVERY = 50  # зберігати прогрес кожні N повідомлень
+
+# Профілювання
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
+# Трасування оновлень
+SLOW_UPDATE_THRESHOLD_MS = 1000  # оновлення, повільніші за поріг, пишуться у slow_updates.log
+
+# Граціозне завершення
+DRAIN_TIMEOUT = 25  # секунд на дренаж до примусового виходу (Heroku дає 30 с після SIGTERM)
+
+# Історія замовлень клієнта
+MY_ORDERS_PAGE_SIZE = 5
+MY_ORDERS_CACHE_SIZE = 10000  # сторінок у кеші історії (з запасом на пул активних клієнтів)
@@ -1,114 +1,573 @@
 import json
 import os
+import sys
+from bisect import bisect_left, insort
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from tracing import traced
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокування між процесами недоступне
+    fcntl = None
+
+
+def _intern(value):
+    """Інтернування рядків, що часто повторюються (статуси, типи, імена)"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _Record:
+    """Базовий компактний запис з доступом як до словника"""
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+    
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        return key in self.__slots__
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+    
+    def keys(self):
+        return self.__slots__
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class UserRecord(_Record):
+    """Запис користувача"""
+    __slots__ = ('username', 'first_name', 'joined_date', 'orders')
+    
+    def __init__(self, username: str, first_name: str, joined_date: str, orders: Optional[List[str]] = None):
+        self.username = _intern(username)
+        self.first_name = _intern(first_name)
+        self.joined_date = joined_date
+        # ID замовлень інтернуються, щоб ділити рядки з ключами Database.orders
+        self.orders = [sys.intern(order_id) for order_id in orders or ()]
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'UserRecord':
+        return cls(data.get('username'), data.get('first_name'), data.get('joined_date'), data.get('orders'))
+    
+    def to_dict(self) -> Dict:
+        return {
+            'username': self.username,
+            'first_name': self.first_name,
+            'joined_date': self.joined_date,
+            'orders': self.orders
+        }
+
+
+class OrderRecord(_Record):
+    """Запис замовлення: поля order_data зберігаються плоско, без копій даних користувача"""
+    __slots__ = ('id', 'user_id', 'username', 'first_name', 'order_type', 'payment_method',
+                 'address', 'order_details', 'photos', 'draft_id', 'status', 'created_date')
+    
+    # Поля чернетки, що зберігаються в замовленні (решта тимчасових ключів відкидається)
+    ORDER_FIELDS = ('order_type', 'payment_method', 'address', 'order_details', 'photos', 'draft_id')
+    
+    def __init__(self, id: str, user_id: int, username: str, first_name: str, order_type: str = None,
+                 payment_method: str = None, address: str = None, order_details: str = None,
+                 photos=None, draft_id: str = None, status: str = 'Новий', created_date: str = None):
+        self.id = sys.intern(id)
+        self.user_id = user_id
+        self.username = _intern(username)
+        self.first_name = _intern(first_name)
+        self.order_type = _intern(order_type)
+        self.payment_method = _intern(payment_method)
+        self.address = address
+        self.order_details = order_details
+        self.photos = tuple(photos) if photos else None
+        # Ключ ідемпотентності чернетки, з якої створено замовлення
+        self.draft_id = draft_id
+        self.status = _intern(status)
+        self.created_date = created_date
+    
+    @property
+    def order_data(self) -> Dict:
+        """Дані замовлення у форматі попередньої версії (для сумісності)"""
+        data = {'username': self.username, 'first_name': self.first_name}
+        for field in self.ORDER_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = list(value) if field == 'photos' else value
+        return data
+    
+    def __getitem__(self, key):
+        if key == 'order_data':
+            return self.order_data
+        return super().__getitem__(key)
+    
+    def __contains__(self, key):
+        return key == 'order_data' or super().__contains__(key)
+    
+    def get(self, key, default=None):
+        if key == 'order_data':
+            return self.order_data
+        return super().get(key, default)
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'OrderRecord':
+        order_data = data.get('order_data', {})
+        return cls(
+            data['id'], data['user_id'], data.get('username'), data.get('first_name'),
+            status=data.get('status', 'Новий'), created_date=data.get('created_date'),
+            **{field: order_data.get(field) for field in cls.ORDER_FIELDS}
+        )
+    
+    def to_dict(self) -> Dict:
+        order_data = self.order_data
+        del order_data['username'], order_data['first_name']
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'username': self.username,
+            'first_name': self.first_name,
+            'order_data': order_data,
+            'status': self.status,
+            'created_date': self.created_date
+        }
+
+
+def _order_number(order_id: str) -> int:
+    """Числова частина ID замовлення (ORDER_000042 -> 42)"""
+    return int(order_id.rpartition('_')[2])
+
+
+class OrderIdAllocator:
+    """Видача зростаючих ID (замовлень, розсилок) за O(1) з лічильника, що резервується на диску блоками"""
+    
+    def __init__(self, path: str, start: int = 1, block_size: int = 100, prefix: str = 'ORDER_', width: int = 6):
+        self.path = path
+        self.block_size = block_size
+        self.prefix = prefix
+        self.width = width
+        # Номери [_next, _limit) зарезервовані цим процесом; перше виділення резервує блок
+        self._next = start
+        self._limit = start
+    
+    def allocate(self) -> str:
+        """Наступний ID замовлення"""
+        if self._next >= self._limit:
+            self._reserve()
+        number = self._next
+        self._next += 1
+        return f"{self.prefix}{number:0{self.width}d}"
+    
+    def _reserve(self):
+        """Резервування наступного блоку номерів (fsync лише раз на блок)"""
+        with open(f"{self.path}.lock", 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Після збою невикористаний залишок блоку пропускається: номери не повторюються
+            start = max(self._read_reserved(), self._next)
+            self._write_reserved(start + self.block_size)
+        self._next, self._limit = start, start + self.block_size
+    
+    def release(self):
+        """Повернення невикористаного залишку блоку (при штатній зупинці), щоб не було пропусків у номерах"""
+        if self._next >= self._limit:
+            return
+        with open(f"{self.path}.lock", 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Інший процес міг зарезервувати наступний блок - тоді залишок просто пропускається
+            if self._read_reserved() == self._limit:
+                self._write_reserved(self._next)
+        self._limit = self._next
+    
+    def _read_reserved(self) -> int:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return int(json.load(f)['reserved'])
+            except:
+                return 0
+        return 0
+    
+    @traced('file.reserve_order_ids')
+    def _write_reserved(self, reserved: int):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'reserved': reserved}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
 
 class Database:
     def __init__(self):
         self.users_file = "users.json"
         self.orders_file = "orders.json"
+        self.broadcasts_file = "broadcasts.json"
+        self.broadcast_recipients_dir = "broadcast_recipients"
+        self.sessions_file = "sessions.json"
+        self.order_ids_file = "order_ids.json"
+        self.broadcast_ids_file = "broadcast_ids.json"
         self.users = self.load_users()
         self.orders = self.load_orders()
+        self.broadcasts = self.load_broadcasts()
+        # ID розсилки -> зафіксований список отримувачів (файл пишеться один раз при старті розсилки)
+        self._broadcast_recipients: Dict[str, List[str]] = {}
+        self.build_segments()
+        self.order_ids = OrderIdAllocator(
+            self.order_ids_file, start=(self._order_numbers[-1] + 1 if self._order_numbers else 1)
+        )
+        # ID розсилок не повторюються після завершення чи скасування: за ними розсилку шукає її завдання
+        self.broadcast_ids = OrderIdAllocator(
+            self.broadcast_ids_file, block_size=1, prefix='BC_', width=4,
+            start=max((_order_number(key) for key in self.broadcasts), default=0) + 1
+        )
+        # Лічильник змін даних для інвалідації кешованих екранів
+        self.version = 0
+        # Лічильники змін замовлень окремих користувачів (для кешу історії замовлень)
+        self.user_versions: Dict[str, int] = defaultdict(int)
     
-    def load_users(self) -> Dict:
+    def load_users(self) -> Dict[str, UserRecord]:
         """Завантаження користувачів з файлу"""
         if os.path.exists(self.users_file):
             try:
                 with open(self.users_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    return {
+                        user_id: UserRecord.from_dict(user)
+                        for user_id, user in json.load(f).items()
+                    }
             except:
                 return {}
         return {}
     
+    @traced('file.save_users')
     def save_users(self):
         """Збереження користувачів у файл"""
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, ensure_ascii=False, indent=2)
+        self._write_json(self.users_file, {user_id: user.to_dict() for user_id, user in self.users.items()})
     
-    def load_orders(self) -> Dict:
+    def load_orders(self) -> Dict[str, OrderRecord]:
         """Завантаження замовлень з файлу"""
         if os.path.exists(self.orders_file):
             try:
                 with open(self.orders_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    orders = (OrderRecord.from_dict(order) for order in json.load(f).values())
+                    return {order.id: order for order in orders}
             except:
                 return {}
         return {}
     
+    @traced('file.save_orders')
     def save_orders(self):
         """Збереження замовлень у файл"""
-        with open(self.orders_file, 'w', encoding='utf-8') as f:
-            json.dump(self.orders, f, ensure_ascii=False, indent=2)
+        self._write_json(self.orders_file, {order_id: order.to_dict() for order_id, order in self.orders.items()})
     
+    def load_broadcasts(self) -> Dict:
+        """Завантаження запланованих розсилок з файлу"""
+        if os.path.exists(self.broadcasts_file):
+            try:
+                with open(self.broadcasts_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except:
+                return {}
+        return {}
+    
+    @traced('file.save_broadcasts')
+    def save_broadcasts(self):
+        """Збереження запланованих розсилок у файл (без відступів: пишеться на кожній контрольній точці)"""
+        self._write_json(self.broadcasts_file, self.broadcasts, indent=None)
+    
+    def _recipients_path(self, broadcast_id: str) -> str:
+        return os.path.join(self.broadcast_recipients_dir, f"{broadcast_id}.json")
+    
+    def load_sessions(self) -> Dict[int, Dict]:
+        """Завантаження незавершених чернеток замовлень, збережених при зупинці (файл видаляється)"""
+        if not os.path.exists(self.sessions_file):
+            return {}
+        try:
+            with open(self.sessions_file, 'r', encoding='utf-8') as f:
+                sessions = {int(user_id): draft for user_id, draft in json.load(f).items()}
+        except:
+            sessions = {}
+        # Одноразове відновлення (див. on_flush у bot.build_application)
+        os.remove(self.sessions_file)
+        return sessions
+    
+    @traced('file.save_sessions')
+    def save_sessions(self, sessions: Dict[int, Dict]):
+        """Збереження незавершених чернеток замовлень"""
+        self._write_json(self.sessions_file, sessions)
+    
+    @staticmethod
+    def _write_json(path: str, data, indent: Optional[int] = 2):
+        """Атомарний запис JSON: файл замінюється лише після повного запису тимчасової копії"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, path)
+    
+    def flush(self):
+        """Збереження всіх даних на диск"""
+        self.save_users()
+        self.save_orders()
+        self.save_broadcasts()
+        self.order_ids.release()
+    
+    @traced('db.add_user')
     def add_user(self, user_id: int, username: str, first_name: str):
         """Додавання нового користувача"""
         if str(user_id) not in self.users:
-            self.users[str(user_id)] = {
-                'username': username,
-                'first_name': first_name,
-                'joined_date': datetime.now().isoformat(),
-                'orders': []
-            }
+            user = UserRecord(username, first_name, datetime.now().isoformat())
+            self.users[str(user_id)] = user
+            insort(self._joined_index, (user.joined_date, str(user_id)))
+            self.version += 1
             self.save_users()
     
+    @traced('db.add_order')
     def add_order(self, user_id: int, order_data: Dict) -> str:
-        """Додавання нового замовлення"""
-        order_id = f"ORDER_{len(self.orders) + 1:06d}"
+        """Додавання нового замовлення (повторне для тієї ж чернетки повертає вже створене)"""
+        existing = self.get_order_by_draft(order_data.get('draft_id'))
+        if existing is not None:
+            return existing.id
+        
+        order_id = self.order_ids.allocate()
         
         # Отримуємо поточну інформацію про користувача
         user_info = self.users.get(str(user_id), {})
         
-        order = {
-            'id': order_id,
-            'user_id': user_id,
-            'username': order_data.get('username') or user_info.get('username', 'Невідомий'),
-            'first_name': order_data.get('first_name') or user_info.get('first_name', 'Невідомий'),
-            'order_data': order_data,
-            'status': 'Новий',
-            'created_date': datetime.now().isoformat()
-        }
+        order = OrderRecord(
+            order_id,
+            user_id,
+            order_data.get('username') or user_info.get('username', 'Невідомий'),
+            order_data.get('first_name') or user_info.get('first_name', 'Невідомий'),
+            created_date=datetime.now().isoformat(),
+            **{field: order_data.get(field) for field in OrderRecord.ORDER_FIELDS}
+        )
         
-        self.orders[order_id] = order
+        self.orders[order.id] = order
+        self._order_ids.append(order.id)
+        self._order_numbers.append(_order_number(order.id))
         
         # Додаємо замовлення до користувача
         if str(user_id) in self.users:
-            self.users[str(user_id)]['orders'].append(order_id)
+            self.users[str(user_id)].orders.append(order.id)
+        
+        self._index_order(order)
+        self.version += 1
+        self.user_versions[str(user_id)] += 1
         
         self.save_orders()
         self.save_users()
         
         return order_id
     
-    def get_user_orders(self, user_id: int) -> List[Dict]:
-        """Отримання замовлень користувача"""
-        user_orders = []
-        for order_id in self.users.get(str(user_id), {}).get('orders', []):
-            if order_id in self.orders:
-                user_orders.append(self.orders[order_id])
-        return user_orders
+    @traced('db.set_order_status')
+    def set_order_status(self, order_id: str, status: str) -> bool:
+        """Зміна статусу замовлення"""
+        order = self.orders.get(order_id)
+        if order is None:
+            return False
+        order.status = _intern(status)
+        self.version += 1
+        self.user_versions[str(order.user_id)] += 1
+        self.save_orders()
+        return True
+    
+    @traced('db.get_user_orders')
+    def get_user_orders(self, user_id: int) -> List[OrderRecord]:
+        """Отримання замовлень користувача (від старіших до новіших)"""
+        return list(self._user_orders.get(str(user_id), ()))
+    
+    @traced('db.count_user_orders')
+    def count_user_orders(self, user_id: int) -> int:
+        """Кількість замовлень користувача"""
+        return len(self._user_orders.get(str(user_id), ()))
+    
+    @traced('db.get_user_orders_page')
+    def get_user_orders_page(self, user_id: int, page: int = 0, size: int = 5) -> Tuple[List[OrderRecord], int]:
+        """Сторінка замовлень користувача від новіших до старіших і загальна кількість замовлень"""
+        user_orders = self._user_orders.get(str(user_id), ())
+        total = len(user_orders)
+        end = max(total - page * size, 0)
+        start = max(end - size, 0)
+        return user_orders[start:end][::-1], total
     
-    def get_recent_orders(self, limit: int = 10) -> List[Dict]:
+    @traced('db.get_recent_orders')
+    def get_recent_orders(self, limit: int = 10) -> List[OrderRecord]:
         """Отримання останніх замовлень"""
-        sorted_orders = sorted(
-            self.orders.values(),
-            key=lambda x: x['created_date'],
-            reverse=True
-        )
-        return sorted_orders[:limit]
+        recent_ids = self._order_ids[max(len(self._order_ids) - limit, 0):]
+        return [self.orders[order_id] for order_id in reversed(recent_ids)]
+    
+    @traced('db.get_orders_between')
+    def get_orders_between(self, start_id: Optional[str] = None, end_id: Optional[str] = None) -> List[OrderRecord]:
+        """Замовлення з ID в діапазоні [start_id, end_id) у порядку створення"""
+        lo = bisect_left(self._order_numbers, _order_number(start_id)) if start_id else 0
+        hi = bisect_left(self._order_numbers, _order_number(end_id)) if end_id else len(self._order_numbers)
+        return [self.orders[order_id] for order_id in self._order_ids[lo:hi]]
     
-    def get_order(self, order_id: str) -> Optional[Dict]:
+    @traced('db.get_order')
+    def get_order(self, order_id: str) -> Optional[OrderRecord]:
         """Отримання конкретного замовлення"""
         return self.orders.get(order_id)
     
+    @traced('db.get_order_by_draft')
+    def get_order_by_draft(self, draft_id: Optional[str]) -> Optional[OrderRecord]:
+        """Отримання замовлення, створеного з чернетки"""
+        order_id = self._draft_orders.get(draft_id) if draft_id else None
+        return self.orders.get(order_id) if order_id else None
+    
+    @traced('db.get_all_users')
     def get_all_users(self) -> List[Dict]:
         """Отримання всіх користувачів"""
         return [
             {
                 'user_id': user_id,
-                'username': user_data.get('username'),
-                'first_name': user_data.get('first_name'),
-                'joined_date': user_data.get('joined_date'),
-                'orders_count': len(user_data.get('orders', []))
+                'username': user.username,
+                'first_name': user.first_name,
+                'joined_date': user.joined_date,
+                'orders_count': len(user.orders)
             }
-            for user_id, user_data in self.users.items()
+            for user_id, user in self.users.items()
         ]
+
+    @traced('db.add_broadcast')
+    def add_broadcast(self, broadcast: Dict) -> str:
+        """Додавання розсилки до черги запланованих"""
+        broadcast_id = self.broadcast_ids.allocate()
+        
+        self.broadcasts[broadcast_id] = {
+            'id': broadcast_id,
+            'status': 'scheduled',
+            # Кількість отримувачів; сам список зберігається окремо (set_broadcast_recipients)
+            'total': None,
+            'offset': 0,
+            'success_count': 0,
+            'error_count': 0,
+            'created_date': datetime.now().isoformat(),
+            **broadcast
+        }
+        self.save_broadcasts()
+        return broadcast_id
+    
+    @traced('db.get_broadcast')
+    def get_broadcast(self, broadcast_id: str) -> Optional[Dict]:
+        """Отримання запланованої розсилки"""
+        return self.broadcasts.get(broadcast_id)
+    
+    @traced('db.remove_broadcast')
+    def remove_broadcast(self, broadcast_id: str) -> Optional[Dict]:
+        """Видалення розсилки з черги запланованих"""
+        broadcast = self.broadcasts.pop(broadcast_id, None)
+        if broadcast is not None:
+            self.save_broadcasts()
+            self._broadcast_recipients.pop(broadcast_id, None)
+            if os.path.exists(self._recipients_path(broadcast_id)):
+                os.remove(self._recipients_path(broadcast_id))
+        return broadcast
+    
+    @traced('db.set_broadcast_recipients')
+    def set_broadcast_recipients(self, broadcast_id: str, recipients: List[str]):
+        """Фіксація аудиторії розсилки на момент старту (окремий файл, щоб не переписувати його з прогресом)"""
+        os.makedirs(self.broadcast_recipients_dir, exist_ok=True)
+        self._write_json(self._recipients_path(broadcast_id), recipients, indent=None)
+        self._broadcast_recipients[broadcast_id] = recipients
+        self.broadcasts[broadcast_id]['total'] = len(recipients)
+        self.save_broadcasts()
+    
+    @traced('db.get_broadcast_recipients')
+    def get_broadcast_recipients(self, broadcast_id: str) -> Optional[List[str]]:
+        """Зафіксована аудиторія розсилки (None, якщо розсилка ще не стартувала)"""
+        recipients = self._broadcast_recipients.get(broadcast_id)
+        if recipients is None and os.path.exists(self._recipients_path(broadcast_id)):
+            try:
+                with open(self._recipients_path(broadcast_id), 'r', encoding='utf-8') as f:
+                    recipients = self._broadcast_recipients[broadcast_id] = json.load(f)
+            except:
+                return None
+        return recipients
+    
+    def build_segments(self):
+        """Побудова індексів аудиторій для розсилок"""
+        # Множини ID користувачів: 'ordered', 'order_type:<тип>', 'payment_method:<спосіб>'
+        self.segments: Dict[str, Set[str]] = defaultdict(set)
+        # Відсортовані пари (дата, ID) для вибірок за діапазоном дат
+        self._joined_index = sorted(
+            (user.joined_date or '', user_id) for user_id, user in self.users.items()
+        )
+        self._last_order_index = []
+        self._last_order_date: Dict[str, str] = {}
+        # ID замовлень, впорядковані за номером (= за часом створення), і їхні номери для bisect
+        self._order_ids = sorted(self.orders, key=_order_number)
+        self._order_numbers = [_order_number(order_id) for order_id in self._order_ids]
+        # Замовлення кожного користувача в порядку створення
+        self._user_orders: Dict[str, List[OrderRecord]] = defaultdict(list)
+        # Ключ чернетки -> ID замовлення
+        self._draft_orders: Dict[str, str] = {}
+        
+        for order in sorted(self.orders.values(), key=lambda x: x.created_date):
+            self._index_order(order)
+    
+    def _index_order(self, order: OrderRecord):
+        """Оновлення індексів аудиторій новим замовленням"""
+        user_id = str(order.user_id)
+        
+        self.segments['ordered'].add(user_id)
+        self._user_orders[user_id].append(order)
+        if order.draft_id:
+            self._draft_orders[order.draft_id] = order.id
+        if order.order_type:
+            self.segments[f"order_type:{order.order_type}"].add(user_id)
+        if order.payment_method:
+            self.segments[f"payment_method:{order.payment_method}"].add(user_id)
+        
+        previous = self._last_order_date.get(user_id)
+        if previous is not None:
+            index = bisect_left(self._last_order_index, (previous, user_id))
+            del self._last_order_index[index]
+        self._last_order_date[user_id] = order.created_date
+        insort(self._last_order_index, (order.created_date, user_id))
+    
+    @staticmethod
+    def _range(index: List, start: Optional[datetime], end: Optional[datetime]) -> Set[str]:
+        """ID користувачів з відсортованого індексу в діапазоні [start, end)"""
+        lo = bisect_left(index, (start.isoformat(),)) if start else 0
+        hi = bisect_left(index, (end.isoformat(),)) if end else len(index)
+        return {user_id for _, user_id in index[lo:hi]}
+    
+    @traced('db.get_segment')
+    def get_segment(self, name: str) -> Set[str]:
+        """Отримання аудиторії за назвою сегмента"""
+        if name == 'all':
+            return set(self.users)
+        if name == 'never_ordered':
+            return self.users.keys() - self.segments['ordered']
+        return set(self.segments.get(name, ()))
+    
+    @traced('db.users_joined_between')
+    def users_joined_between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Set[str]:
+        """Користувачі, що приєдналися в діапазоні дат"""
+        return self._range(self._joined_index, start, end)
+    
+    @traced('db.users_last_ordered_between')
+    def users_last_ordered_between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Set[str]:
+        """Користувачі, чиє останнє замовлення в діапазоні дат"""
+        return self._range(self._last_order_index, start, end)
+    
+    @traced('db.select_audience')
+    def select_audience(self, include: Iterable[Set[str]] = (), require: Iterable[Set[str]] = (),
+                        exclude: Iterable[Set[str]] = ()) -> Set[str]:
+        """Комбінування сегментів: об'єднання include, перетин з require, виключення exclude"""
+        include = list(include)
+        audience = set().union(*include) if include else self.get_segment('all')
+        for segment in require:
+            audience &= segment
+        for segment in exclude:
+            audience -= segment
+        return audience
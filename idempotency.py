@@ -0,0 +1,53 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class IdempotentCalls:
+    """Однократне виконання операцій за ключем: паралельні виклики чекають першого, повтори отримують його результат"""
+
+    def __init__(self, max_results: int = 1024):
+        self.max_results = max_results
+        # ключ -> future операції, що виконується зараз
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        # ключ -> результат завершеної операції (найстаріші витісняються)
+        self._results: OrderedDict = OrderedDict()
+        self.executed = 0
+        self.collapsed = 0
+        self.replayed = 0
+
+    async def run(self, key: Hashable, operation: Callable[[], Awaitable[Any]]) -> Any:
+        """Виконати операцію один раз для ключа (результат None не запам'ятовується)"""
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.replayed += 1
+            return self._results[key]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.collapsed += 1
+            # shield: скасування одного з очікувачів не скасовує операцію для інших
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self.executed += 1
+        try:
+            result = await operation()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Позначаємо виняток отриманим, якщо інших очікувачів немає
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if result is not None:
+                self._results[key] = result
+                if len(self._results) > self.max_results:
+                    self._results.popitem(last=False)
+            return result
+        finally:
+            del self._in_flight[key]
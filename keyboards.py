@@ -1,5 +1,6 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from config import BUTTONS
+from router import CallbackRouter
 
 def get_main_keyboard():
     """Головна клавіатура"""
@@ -18,10 +19,10 @@ def get_payment_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def get_confirm_keyboard():
+def get_confirm_keyboard(draft_id):
     """Клавіатура підтвердження замовлення"""
     keyboard = [
-        [InlineKeyboardButton(BUTTONS['confirm_order'], callback_data='confirm_order')],
+        [InlineKeyboardButton(BUTTONS['confirm_order'], callback_data=CallbackRouter.build('confirm_order', draft_id))],
         [InlineKeyboardButton(BUTTONS['back_to_main'], callback_data='back_to_main')]
     ]
     return InlineKeyboardMarkup(keyboard)
@@ -36,6 +37,45 @@ def get_admin_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
+def get_broadcast_type_keyboard():
+    """Клавіатура вибору типу розсилки"""
+    keyboard = [
+        [InlineKeyboardButton("📝 Тільки текст", callback_data='broadcast_text_only')],
+        [InlineKeyboardButton("📸 Фото з текстом", callback_data='broadcast_photo_text')],
+        [InlineKeyboardButton("🔙 Назад", callback_data='admin_panel')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def get_broadcast_confirm_keyboard():
+    """Клавіатура підтвердження розсилки"""
+    keyboard = [
+        [InlineKeyboardButton("✅ Так, відправити", callback_data='confirm_broadcast')],
+        [InlineKeyboardButton("🎯 Аудиторія", callback_data='broadcast_segments')],
+        [InlineKeyboardButton("⏰ Запланувати", callback_data='schedule_broadcast')],
+        [InlineKeyboardButton("🌙 У непіковий час", callback_data='offpeak_broadcast')],
+        [InlineKeyboardButton("❌ Ні, змінити", callback_data='change_broadcast')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def get_segment_keyboard(options):
+    """Клавіатура вибору аудиторії розсилки: options - список (ключ, назва, режим)"""
+    marks = {'include': '➕', 'require': '🔗', 'exclude': '➖'}
+    keyboard = [
+        [InlineKeyboardButton(f"{marks.get(mode, '▫️')} {label}", callback_data=CallbackRouter.build('bseg', key))]
+        for key, label, mode in options
+    ]
+    keyboard.append([InlineKeyboardButton("✔️ Готово", callback_data='bseg_done')])
+    return InlineKeyboardMarkup(keyboard)
+
+def get_my_orders_keyboard(page, has_next):
+    """Клавіатура гортання історії замовлень клієнта"""
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Новіші", callback_data=CallbackRouter.build('my_orders', page - 1)))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Старіші ➡️", callback_data=CallbackRouter.build('my_orders', page + 1)))
+    return InlineKeyboardMarkup([navigation] if navigation else [])
+
 def get_back_keyboard():
     """Клавіатура з кнопкою назад"""
     keyboard = [
@@ -0,0 +1,217 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+from datetime import timedelta
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Класи пріоритету вихідних повідомлень (менше значення - вищий пріоритет)"""
+    INTERACTIVE = 0
+    ADMIN = 1
+    RELAY = 2
+    BROADCAST = 3
+
+
+class _ClassStats:
+    """Метрики одного класу пріоритету"""
+    __slots__ = ('sent', 'failed', 'retries', 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+
+class OutboundScheduler:
+    """Єдина черга вихідних викликів Bot API з пріоритетами та повторами"""
+
+    def __init__(self, rate: float = 25.0, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 30.0, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._counter = itertools.count()
+        self._depth = {priority: 0 for priority in Priority}
+        self._stats = {priority: _ClassStats() for priority in Priority}
+        self._in_flight = 0
+        self._tasks = set()
+        # Future викликів, результату яких ще чекають відправники
+        self._pending = set()
+        self._idle: Optional[asyncio.Event] = None
+
+        # Час, до якого всі відправки призупинені через flood control
+        self._paused_until = 0.0
+        # Token bucket: поки є запас, виклики йдуть без затримки
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+
+    def start(self):
+        """Запуск диспетчера черги"""
+        if self._dispatcher is not None and not self._dispatcher.done():
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        logger.info("Планувальник вихідних повідомлень запущено")
+
+    async def stop(self, timeout: Optional[float] = None) -> bool:
+        """Зупинка диспетчера; повертає True, якщо черга встигла спорожніти"""
+        drained = await self.join(timeout)
+        tasks = list(self._tasks)
+        if self._dispatcher is not None:
+            tasks.append(self._dispatcher)
+            self._dispatcher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Невідправлені виклики завершуються помилкою, інакше їхні send() чекали б вічно
+        error = RuntimeError("Планувальник вихідних повідомлень зупинено")
+        for future in list(self._pending):
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        self._depth = {priority: 0 for priority in Priority}
+        self._in_flight = 0
+        if self._idle is not None:
+            self._idle.set()
+        return drained
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Очікування відправки всіх поставлених у чергу викликів"""
+        if self._idle is None:
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def send(self, priority: Priority, func: Callable[..., Awaitable],
+                   *args, **kwargs) -> Any:
+        """Поставити виклик Bot API у чергу та дочекатися результату"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        self._depth[priority] += 1
+        self._in_flight += 1
+        self._idle.clear()
+        with span(f"api.{getattr(func, '__name__', 'call')}"):
+            await self._queue.put((priority, next(self._counter), time.monotonic(),
+                                   func, args, kwargs, future))
+            return await future
+
+    async def _dispatch(self):
+        """Видача викликів з черги з урахуванням ліміту швидкості"""
+        while True:
+            priority, _, enqueued, func, args, kwargs, future = await self._queue.get()
+            self._depth[priority] -= 1
+            await self._acquire_slot()
+            task = asyncio.create_task(self._execute(priority, enqueued, func, args, kwargs, future))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _acquire_slot(self):
+        """Очікування вільного слоту відправки"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        # Резервуємо токен до очікування, щоб паралельні повтори не зайняли той самий
+        self._tokens -= 1
+        wait = max(self._paused_until - now, -self._tokens / self.rate)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _backoff(self, attempt: int) -> float:
+        """Затримка перед повтором з jitter"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    async def _execute(self, priority, enqueued, func, args, kwargs, future):
+        """Виконання виклику з повторами при тимчасових помилках"""
+        stats = self._stats[priority]
+        attempt = 0
+        try:
+            while True:
+                try:
+                    result = await func(*args, **kwargs)
+                    stats.sent += 1
+                    if not future.done():
+                        future.set_result(result)
+                    return
+                except RetryAfter as e:
+                    delay = e.retry_after
+                    if isinstance(delay, timedelta):
+                        delay = delay.total_seconds()
+                    # Flood control діє на весь бот, тому призупиняємо всю чергу
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    logger.warning(f"Flood control: пауза {delay} с ({priority.name})")
+                    error = e
+                except BadRequest as e:
+                    # BadRequest успадковує NetworkError, але повтор його не виправить
+                    stats.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                    return
+                except (TimedOut, NetworkError) as e:
+                    delay = self._backoff(attempt)
+                    error = e
+                except Exception as e:
+                    stats.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                    return
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    stats.failed += 1
+                    logger.error(f"Вичерпано повтори відправки ({priority.name}): {error}")
+                    if not future.done():
+                        future.set_exception(error)
+                    return
+
+                stats.retries += 1
+                await asyncio.sleep(delay)
+                await self._acquire_slot()
+        finally:
+            latency = time.monotonic() - enqueued
+            stats.latency_total += latency
+            stats.latency_max = max(stats.latency_max, latency)
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Глибина черги та затримки по класах пріоритету"""
+        result = {}
+        for priority in Priority:
+            stats = self._stats[priority]
+            done = stats.sent + stats.failed
+            result[priority.name.lower()] = {
+                'queued': self._depth[priority],
+                'sent': stats.sent,
+                'failed': stats.failed,
+                'retries': stats.retries,
+                'avg_latency_ms': stats.latency_total / done * 1000 if done else 0.0,
+                'max_latency_ms': stats.latency_max * 1000
+            }
+        return result
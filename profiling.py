@@ -0,0 +1,63 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+from typing import Optional, Tuple
+
+# Одночасно може працювати лише один профайлер
+_profile_lock = asyncio.Lock()
+
+# Сигнал дострокового завершення поточної сесії
+_stop_requested: Optional[asyncio.Event] = None
+
+
+def is_profiling() -> bool:
+    """Чи триває зараз сесія профілювання"""
+    return _profile_lock.locked()
+
+
+def stop_profile():
+    """Дострокове завершення поточної сесії (звіт буде за вже зібраний час)"""
+    if _stop_requested is not None:
+        _stop_requested.set()
+
+
+async def run_profile(seconds: float, top: int = 30) -> Tuple[str, bytes]:
+    """Профілювання event loop та обробників протягом вказаного часу (або до stop_profile).
+
+    Профайлер вмикається лише на час сесії, тому поза нею він нічого не коштує.
+    Повертає текст з топом функцій за кумулятивним часом та вміст .prof файлу.
+    """
+    if _profile_lock.locked():
+        raise RuntimeError("Профілювання вже виконується")
+
+    global _stop_requested
+    async with _profile_lock:
+        _stop_requested = asyncio.Event()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.wait_for(_stop_requested.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            profiler.disable()
+            _stop_requested = None
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+
+    # pstats вміє зберігати лише у файл
+    fd, path = tempfile.mkstemp(suffix='.prof')
+    os.close(fd)
+    try:
+        profiler.dump_stats(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+    finally:
+        os.remove(path)
+
+    return stream.getvalue(), data
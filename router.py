@@ -0,0 +1,79 @@
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Роздільник аргументів у структурованому callback_data: "префікс:арг1:арг2"
+SEPARATOR = ':'
+
+
+class _Route:
+    """Опис маршруту callback"""
+    __slots__ = ('name', 'handler', 'admin', 'on_denied')
+
+    def __init__(self, name: str, handler: Callable[..., Awaitable], admin: bool,
+                 on_denied: Optional[Callable[..., Awaitable]]):
+        self.name = name
+        self.handler = handler
+        self.admin = admin
+        self.on_denied = on_denied
+
+
+class CallbackRouter:
+    """Таблиця маршрутів callback_data -> обробник з диспетчеризацією за O(1)"""
+
+    def __init__(self, admin_ids: Iterable[int]):
+        self.admin_ids = set(admin_ids)
+        self._exact: Dict[str, _Route] = {}
+        self._prefixes: Dict[str, _Route] = {}
+        self.counts = Counter()
+
+    def route(self, *names: str, admin: bool = False, on_denied: Optional[Callable[..., Awaitable]] = None):
+        """Реєстрація обробника для точних значень callback_data"""
+        def decorator(handler):
+            for name in names:
+                self._exact[name] = _Route(name, handler, admin, on_denied)
+            return handler
+        return decorator
+
+    def prefix(self, name: str, admin: bool = False, on_denied: Optional[Callable[..., Awaitable]] = None):
+        """Реєстрація обробника для callback_data виду "name:арг1:арг2" (аргументи передаються в обробник)"""
+        def decorator(handler):
+            self._prefixes[name] = _Route(name, handler, admin, on_denied)
+            return handler
+        return decorator
+
+    @staticmethod
+    def build(name: str, *args) -> str:
+        """Формування структурованого callback_data (не довше 64 байт)"""
+        data = SEPARATOR.join([name, *map(str, args)])
+        if len(data.encode('utf-8')) > 64:
+            raise ValueError(f"callback_data задовгий: {data}")
+        return data
+
+    async def dispatch(self, update, context):
+        """Виклик обробника, що відповідає callback_data"""
+        query = update.callback_query
+        data = query.data or ''
+        args = ()
+
+        route = self._exact.get(data)
+        if route is None:
+            name, _, payload = data.partition(SEPARATOR)
+            route = self._prefixes.get(name)
+            args = tuple(payload.split(SEPARATOR)) if payload else ()
+
+        if route is None:
+            self.counts['<unknown>'] += 1
+            logger.warning(f"Невідомий callback: {data}")
+            return None
+
+        if route.admin and query.from_user.id not in self.admin_ids:
+            self.counts[f"{route.name} (denied)"] += 1
+            if route.on_denied is not None:
+                return await route.on_denied(update, context)
+            return None
+
+        self.counts[route.name] += 1
+        return await route.handler(update, context, *args)
@@ -0,0 +1,355 @@
+"""Soak-тест процесу бота: мільйони симульованих оновлень з контролем зростання пам'яті.
+
+Обробники bot.py виконуються в цьому процесі, а HTTP-шар Bot API підмінено (FakeRequest),
+тому жодних запитів до Telegram немає. Логи та службові файли бота пишуться в тимчасовий
+каталог.
+
+Запуск: python soak_test.py [--updates 1000000] [--users 5000] [--budget-mb 4]
+
+Запис JSON бази на диск вимкнено (див. soak()), швидкість - близько 250 оновлень/с під
+tracemalloc, тож прогін за замовчуванням (1 млн) триває понад годину. Швидкий прогін:
+--users 1000 --updates 100000 --warmup 30000 (близько 7 хв); на такому короткому вікні RSS ще
+не вийшов на плато, тому оцінка його зростання завищена.
+
+Код виходу 1, якщо пам'ять після прогріву зростає швидше за бюджет на 100 тис. оновлень.
+Після прогріву кожен вимір друкує топ зростань алокацій tracemalloc і перезаписує
+tracemalloc_top.txt у робочому каталозі (з --keep файл лишається і після аварійного завершення).
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+PER_UPDATES = 100_000
+
+
+class FakeRequest(BaseRequest):
+    """HTTP-шар Bot API, що відповідає успіхом без мережі"""
+
+    def __init__(self):
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+        # chat_id -> остання надіслана клавіатура (кількість чатів обмежена пулом користувачів)
+        self.last_markup = {}
+
+    @property
+    def read_timeout(self):
+        return 5
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.requests += 1
+        name = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+
+        if name == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Soak', 'username': 'soak_bot'}
+        elif name in ('sendMessage', 'sendPhoto', 'editMessageText', 'editMessageReplyMarkup'):
+            chat_id = int(params.get('chat_id', 0))
+            if 'reply_markup' in params:
+                self.last_markup[chat_id] = params['reply_markup']
+            result = {
+                'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text') or params.get('caption', '')
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def button(self, chat_id: int, prefix: str):
+        """callback_data кнопки з останньої клавіатури чату, що починається з prefix"""
+        markup = self.last_markup.get(chat_id) or {}
+        for row in markup.get('inline_keyboard', ()):
+            for button in row:
+                if button.get('callback_data', '').startswith(prefix):
+                    return button['callback_data']
+        return prefix
+
+
+class Simulator:
+    """Генератор оновлень: сесії клієнтів (замовлення, покинуті кошики, перегляд) та адміна"""
+
+    # Вага сценаріїв серед нових сесій
+    SCENARIOS = {'browse': 50, 'abandoned': 35, 'order': 5, 'double_confirm': 2, 'admin': 3}
+
+    def __init__(self, request: FakeRequest, users: int, admin_id, seed: int):
+        self.request = request
+        self.user_ids = [10_000_000 + n for n in range(users)]
+        self.admin_id = admin_id
+        self.random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._sessions = {}
+        self.started = {name: 0 for name in self.SCENARIOS}
+        scenarios = self.SCENARIOS if admin_id is not None else {
+            name: weight for name, weight in self.SCENARIOS.items() if name != 'admin'
+        }
+        self._names = list(scenarios)
+        self._weights = list(scenarios.values())
+
+    def next_update(self) -> dict:
+        """Наступне оновлення від випадкового користувача"""
+        while True:
+            name = self.random.choices(self._names, self._weights)[0]
+            user_id = self.admin_id if name == 'admin' else self.random.choice(self.user_ids)
+            session = self._sessions.get(user_id)
+            if session is None:
+                self.started[name] += 1
+                session = self._sessions[user_id] = getattr(self, f"_{name}")(user_id)
+            update = next(session, None)
+            if update is not None:
+                return update
+            del self._sessions[user_id]
+
+    def message(self, user_id: int, text: str) -> dict:
+        message = {
+            'message_id': next(self._update_ids), 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Soak', 'username': f"soak{user_id}"},
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)), 'chat_instance': 'soak', 'data': data,
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Soak', 'username': f"soak{user_id}"},
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                            'text': 'old'}
+            }
+        }
+
+    def _order_steps(self, user_id: int, confirms: int):
+        yield self.message(user_id, '/start')
+        yield self.callback(user_id, self.random.choice(['in_stock', 'pre_order']))
+        yield self.message(user_id, f"Кросівки розмір {self.random.randint(36, 46)}")
+        yield self.callback(user_id, self.random.choice(['cash_on_delivery', 'prepayment']))
+        yield self.message(user_id, f"м. Київ, відділення №{self.random.randint(1, 400)}")
+        # draft_id відомий лише з клавіатури, яку бот щойно надіслав; повторне натискання - та сама кнопка,
+        # бо після першого підтвердження клавіатуру вже замінено головним меню
+        confirm = self.request.button(user_id, 'confirm_order')
+        for _ in range(confirms):
+            yield self.callback(user_id, confirm)
+
+    def _order(self, user_id: int):
+        return self._order_steps(user_id, confirms=1)
+
+    def _double_confirm(self, user_id: int):
+        return self._order_steps(user_id, confirms=2)
+
+    def _abandoned(self, user_id: int):
+        # Кошик покидається на випадковому кроці: чернетка лишається в user_data
+        return itertools.islice(self._order_steps(user_id, confirms=1), self.random.randint(2, 5))
+
+    def _browse(self, user_id: int):
+        yield self.message(user_id, '/start')
+        yield self.message(user_id, '/my_orders')
+        yield self.callback(user_id, 'my_orders:1')
+        yield self.callback(user_id, 'back_to_main')
+        yield self.message(user_id, '/ping')
+
+    def _admin(self, user_id: int):
+        yield self.message(user_id, '/start')
+        yield self.callback(user_id, 'admin_panel')
+        yield self.callback(user_id, 'admin_stats')
+        yield self.callback(user_id, 'admin_view_orders')
+        yield self.callback(user_id, 'admin_broadcast')
+        yield self.callback(user_id, 'broadcast_text_only')
+        yield self.message(user_id, 'Нова колекція вже в наявності!')
+        yield self.callback(user_id, 'broadcast_segments')
+        yield self.callback(user_id, 'bseg:ordered_30d')
+        yield self.callback(user_id, 'bseg:prepayment')
+        yield self.callback(user_id, 'bseg:prepayment')
+        yield self.callback(user_id, 'bseg_done')
+        # Зрідка розсилка відправляється, зазвичай чернетка покидається
+        if self.random.random() < 0.05:
+            yield self.callback(user_id, 'confirm_broadcast')
+        else:
+            yield self.callback(user_id, 'change_broadcast')
+        yield self.message(user_id, '/stats')
+        yield self.message(user_id, '/scheduled')
+
+
+def rss_bytes() -> int:
+    """Поточний RSS процесу (на Linux) або піковий, якщо /proc недоступний"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def structure_sizes(bot, application) -> dict:
+    """Розміри структур, що можуть накопичуватися з часом"""
+    return {
+        'drafts': len(bot.user_data),
+        'ctx_user_data': sum(1 for data in application.user_data.values() if data),
+        'db_users': len(bot.db.users),
+        'db_orders': len(bot.db.orders),
+        'broadcasts': len(bot.db.broadcasts),
+        'views': len(bot.view_cache._views),
+        'order_views': len(bot.my_orders_cache._views),
+        'confirmations': len(bot.order_confirmations._results),
+        'routes': len(bot.callback_router.counts),
+        'outbox': sum(bot.outbox._depth.values()),
+    }
+
+
+def growth_per_updates(samples, key: str) -> float:
+    """Нахил (байт на PER_UPDATES оновлень) за методом найменших квадратів"""
+    xs = [sample['updates'] for sample in samples]
+    ys = [sample[key] for sample in samples]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance * PER_UPDATES
+
+
+def report_allocations(baseline, top: int, title: str):
+    """Топ зростань алокацій відносно бази: друк і запис у файл робочого каталогу"""
+    lines = [f"{title}:"] + [f"  {stat}" for stat in
+                             tracemalloc.take_snapshot().compare_to(baseline, 'lineno')[:top]]
+    print('\n'.join(lines), flush=True)
+    # Файл перезаписується на кожному вимірі, щоб дані не загубилися, якщо прогін буде перервано
+    with open('tracemalloc_top.txt', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+async def soak(args, bot) -> bool:
+    from config import ADMIN_IDS, OUTBOUND_MAX_RETRIES
+    from outbound import OutboundScheduler
+
+    # Без обмеження швидкості: FakeRequest відповідає миттєво
+    bot.outbox = OutboundScheduler(rate=1_000_000, max_retries=OUTBOUND_MAX_RETRIES)
+    # Database переписує весь файл на кожного нового користувача і замовлення: на мільйоні оновлень
+    # це O(n^2) і займало б добу. Вимірюється пам'ять процесу, тому запис JSON на диск вимикається
+    bot.db._write_json = lambda path, data, indent=2: None
+
+    request = FakeRequest()
+    application = bot.build_application(request)
+    await application.initialize()
+    await application.start()
+    bot.outbox.start()
+
+    simulator = Simulator(request, args.users, ADMIN_IDS[0] if ADMIN_IDS else None, args.seed)
+    samples = []
+    baseline = None
+    started = time.monotonic()
+
+    print(f"{'оновлень':>10} {'RSS, МБ':>9} {'heap, МБ':>9} {'upd/с':>7}  структури")
+    for count in range(1, args.updates + 1):
+        await application.process_update(Update.de_json(simulator.next_update(), application.bot))
+
+        if count % args.sample_every == 0 or count == args.updates:
+            await bot.outbox.join(timeout=30)
+            gc.collect()
+            # Знімок бази порівняння береться до виміру, щоб його власна пам'ять не виглядала як зростання
+            if count >= args.warmup and baseline is None:
+                baseline = tracemalloc.take_snapshot()
+            sample = {'updates': count, 'rss': rss_bytes(), 'heap': tracemalloc.get_traced_memory()[0]}
+            sizes = structure_sizes(bot, application)
+            rate = count / (time.monotonic() - started)
+            print(f"{count:>10} {sample['rss'] / 2**20:>9.1f} {sample['heap'] / 2**20:>9.1f} {rate:>7.0f}  "
+                  + ' '.join(f"{name}={value}" for name, value in sizes.items()), flush=True)
+            if count >= args.warmup:
+                samples.append(sample)
+                if len(samples) > 1:
+                    report_allocations(baseline, args.top, f"Топ-{args.top} зростань алокацій на {count} оновлень")
+
+    await application.stop()
+    await bot.post_stop(application)
+    await application.shutdown()
+
+    print(f"\nСценарії: {simulator.started}, запитів до Bot API: {request.requests}")
+    confirmations = bot.order_confirmations
+    print(f"Підтвердження замовлень: виконано {confirmations.executed}, "
+          f"об'єднано {confirmations.collapsed}, повторено {confirmations.replayed}")
+    errors = bot.bot_stats['errors']
+    print(f"{'✅' if not errors else '❌'} Помилок в обробниках: {errors}")
+
+    if baseline is not None:
+        print()
+        report_allocations(baseline, args.top, f"Топ-{args.top} зростань алокацій після прогріву")
+
+    if len(samples) < 2:
+        print("\n⚠️ Замало вимірів після прогріву, збільште --updates або зменшіть --warmup")
+        return not errors
+
+    budget = args.budget_mb * 2**20
+    passed = True
+    print(f"\nЗростання на {PER_UPDATES} оновлень (бюджет {args.budget_mb} МБ):")
+    for key in ('heap', 'rss'):
+        growth = growth_per_updates(samples, key)
+        ok = growth <= budget
+        passed &= ok
+        print(f"  {'✅' if ok else '❌'} {key}: {growth / 2**20:+.2f} МБ")
+    return passed and not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak-тест пам'яті бота")
+    parser.add_argument('--updates', type=int, default=1_000_000, help="кількість симульованих оновлень")
+    parser.add_argument('--users', type=int, default=5000, help="розмір пулу клієнтів")
+    parser.add_argument('--sample-every', type=int, default=10_000, help="інтервал вимірів (оновлень)")
+    parser.add_argument('--warmup', type=int, default=100_000, help="оновлень до початку оцінки зростання")
+    parser.add_argument('--budget-mb', type=float, default=4.0, help=f"допустиме зростання на {PER_UPDATES} оновлень")
+    parser.add_argument('--top', type=int, default=15, help="кількість рядків звіту tracemalloc")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help="не видаляти робочий каталог")
+    args = parser.parse_args()
+
+    # bot.py при імпорті відкриває базу і логи в поточному каталозі
+    workdir = tempfile.mkdtemp(prefix='bot_soak_')
+    os.chdir(workdir)
+    print(f"Робочий каталог: {workdir}")
+
+    tracemalloc.start()
+    import bot
+
+    # Логи лишаються у файлах робочого каталогу, консоль - лише для звіту
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if type(handler) is logging.StreamHandler:
+            root.removeHandler(handler)
+
+    try:
+        passed = asyncio.run(soak(args, bot))
+    finally:
+        tracemalloc.stop()
+        if not args.keep:
+            os.chdir(tempfile.gettempdir())
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if not passed:
+        print("\n❌ Soak-тест не пройдено: зростання пам'яті понад бюджет або помилки в обробниках")
+        sys.exit(1)
+    print("\n✅ Зростання пам'яті в межах бюджету, помилок немає")
+
+
+if __name__ == '__main__':
+    main()
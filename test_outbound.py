@@ -0,0 +1,85 @@
+"""Тести повторів OutboundScheduler.
+
+Запуск: python -m unittest test_outbound
+"""
+import asyncio
+import time
+import unittest
+
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+from outbound import OutboundScheduler, Priority
+
+
+class FlakyCall:
+    """Виклик Bot API, що спочатку кидає задані помилки, а потім повертає 'ok'"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.__name__ = 'flaky_call'
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class OutboundRetryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.outbox = OutboundScheduler(rate=1000, max_retries=3, base_delay=0.01, max_delay=0.02)
+
+    async def asyncTearDown(self):
+        await self.outbox.stop(timeout=1)
+
+    async def test_bad_request_fails_immediately(self):
+        call = FlakyCall(BadRequest("Chat not found"))
+        started = time.monotonic()
+        with self.assertRaises(BadRequest):
+            await self.outbox.send(Priority.BROADCAST, call)
+        self.assertEqual(call.calls, 1)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(self.outbox.metrics()['broadcast']['retries'], 0)
+
+    async def test_timed_out_is_retried(self):
+        call = FlakyCall(TimedOut(), TimedOut())
+        self.assertEqual(await self.outbox.send(Priority.INTERACTIVE, call), 'ok')
+        self.assertEqual(call.calls, 3)
+
+    async def test_retry_after_is_retried(self):
+        call = FlakyCall(RetryAfter(0))
+        self.assertEqual(await self.outbox.send(Priority.INTERACTIVE, call), 'ok')
+        self.assertEqual(call.calls, 2)
+
+    async def test_retries_are_limited(self):
+        call = FlakyCall(*[TimedOut()] * 10)
+        with self.assertRaises(TimedOut):
+            await self.outbox.send(Priority.INTERACTIVE, call)
+        self.assertEqual(call.calls, 4)
+
+
+class OutboundStopTest(unittest.IsolatedAsyncioTestCase):
+    async def test_stop_fails_pending_calls(self):
+        # Перший виклик зависає під час виконання, решта чекають слоту в черзі
+        outbox = OutboundScheduler(rate=2, burst=1)
+        blocked = asyncio.Event()
+
+        async def hang():
+            await blocked.wait()
+
+        senders = [asyncio.create_task(outbox.send(Priority.BROADCAST, hang)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        self.assertFalse(await outbox.stop(timeout=0.05))
+
+        for result in await asyncio.gather(*senders, return_exceptions=True):
+            self.assertIsInstance(result, RuntimeError)
+        self.assertEqual(outbox.metrics()['broadcast']['queued'], 0)
+
+        # Після зупинки планувальник знову приймає виклики і спорожняється
+        self.assertEqual(await outbox.send(Priority.INTERACTIVE, FlakyCall()), 'ok')
+        self.assertTrue(await outbox.stop(timeout=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import functools
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+# Максимум збережених ділянок на одне оновлення (наприклад, для розсилки з тисяч викликів)
+MAX_SPANS = 200
+
+# Трасування поточного оновлення (успадковується задачами, створеними під час обробки)
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """Трасування обробки одного оновлення"""
+    __slots__ = ('trace_id', 'started', 'spans', 'dropped')
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        # (назва, початок від старту, тривалість) у мілісекундах
+        self.spans: List[Tuple[str, float, float]] = []
+        self.dropped = 0
+
+    def elapsed_ms(self) -> float:
+        """Час від початку обробки"""
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_log_line(self, **fields) -> str:
+        """Один рядок JSON для журналу повільних оновлень"""
+        record = {
+            'trace_id': self.trace_id,
+            'total_ms': round(self.elapsed_ms(), 2),
+            **fields,
+            'dropped_spans': self.dropped,
+            'spans': [
+                {'name': name, 'start_ms': round(start, 2), 'ms': round(duration, 2)}
+                for name, start, duration in self.spans
+            ]
+        }
+        return json.dumps(record, ensure_ascii=False)
+
+
+def start_trace():
+    """Початок трасування; повертає трасування та токен для завершення"""
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(token):
+    """Завершення трасування поточного оновлення"""
+    _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    """Замір ділянки коду в межах поточного трасування"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        finished = time.perf_counter()
+        if len(trace.spans) < MAX_SPANS:
+            trace.spans.append((name, (started - trace.started) * 1000, (finished - started) * 1000))
+        else:
+            trace.dropped += 1
+
+
+def traced(name: str):
+    """Декоратор для заміру синхронних функцій (виклики БД, запис файлів)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_handler(func):
+    """Обгортка для заміру обробника оновлень"""
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        with span(f"handler.{func.__name__}"):
+            return await func(update, context)
+    return wrapper
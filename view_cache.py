@@ -0,0 +1,41 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class ViewCache:
+    """Кеш відрендерених екранів з інвалідацією за версією даних"""
+
+    def __init__(self, max_views: int = 256):
+        self.max_views = max_views
+        # ключ -> (версія даних, відрендерений вміст)
+        self._views: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.skipped_edits = 0
+
+    def get_or_render(self, key: Hashable, version: Hashable, render: Callable[[], Any]) -> Any:
+        """Повернути екран з кешу, якщо версія даних не змінилася, інакше відрендерити"""
+        cached = self._views.get(key)
+        if cached is not None and cached[0] == version:
+            self._views.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        value = render()
+        self._views[key] = (version, value)
+        self._views.move_to_end(key)
+        if len(self._views) > self.max_views:
+            self._views.popitem(last=False)
+        return value
+
+    def is_unchanged(self, message, text: str, reply_markup=None) -> bool:
+        """Чи збігається новий вміст з тим, що вже показано у повідомленні"""
+        # Недоступні (старі) повідомлення не містять тексту
+        if getattr(message, 'text', None) is None:
+            return False
+        # Telegram обрізає пробіли на краях тексту повідомлення
+        unchanged = message.text == text.strip() and message.reply_markup == reply_markup
+        if unchanged:
+            self.skipped_edits += 1
+        return unchanged